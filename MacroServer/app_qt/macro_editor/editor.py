@@ -25,7 +25,9 @@ class MacroEditor(QWidget):
     def __init__(self, macro, exit_fn=None):
         super().__init__()
         self.orig_macro = macro
-        self.macro = Macro(macro.name, macro.description, macro.commands, macro.repeat, macro.position, macro.timing)
+        # The editor changes commands in place, a cancelled edit must not change the macro it was opened with
+        self.macro = Macro(macro.name, macro.description, Macro.copy_commands(macro.commands), macro.repeat,
+                           macro.position, macro.timing)
         self.exit_fn = exit_fn
         self.sequence_list = None
         self.name_input = None
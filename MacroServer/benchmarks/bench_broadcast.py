@@ -0,0 +1,59 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_compression import make_catalog
+from macro_server import Server, ServerOptions, SocketClient
+
+MACRO_COUNT = 5000
+CLIENT_COUNT = 50
+REPEAT = 5
+
+
+class SinkSocket:
+    # Accepts everything right away, so only the server side of the broadcast is measured
+    def send(self, data):
+        return len(data)
+
+
+def make_server(framings):
+    server = Server(ServerOptions(max_queue_size=1 << 30))
+    server.loop_thread = threading.get_ident()
+    for i in range(CLIENT_COUNT):
+        client = SocketClient(SinkSocket(), "127.0.0.1", 10000 + i)
+        client.framing, client.compression = framings[i % len(framings)]
+        server.clients[(client.addr, client.port)] = client
+    return server
+
+
+def measure(fn):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    data = make_catalog(MACRO_COUNT)["data"]
+    print(f"update-macro-list of {MACRO_COUNT} macros to {CLIENT_COUNT} clients")
+    print(f"  {'clients':<28} {'per client ms':>14} {'encode once ms':>15} {'speedup':>8}")
+    for name, framings in (("json", [("json", None)]),
+                           ("binary + zlib", [("binary", "zlib")]),
+                           ("mixed json/binary/zlib", [("json", None), ("binary", None), ("binary", "zlib")])):
+        server = make_server(framings)
+        clients = list(server.clients.values())
+        # What send_message_to_all did before, one encode for every client
+        each_ms = measure(lambda: [server.send_message(client, "update-macro-list", data) for client in clients])
+        once_ms = measure(lambda: server.send_message_to_all("update-macro-list", data))
+        print(f"  {name:<28} {each_ms:>14.1f} {once_ms:>15.1f} {each_ms / once_ms:>7.1f}x")
+        server.catalog.close()
+
+
+if __name__ == "__main__":
+    main()
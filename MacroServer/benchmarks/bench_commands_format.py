@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+# Lets pynput import on machines without a display, only the key objects are created
+os.environ.setdefault("PYNPUT_BACKEND", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from macro import JsonMacroStore, Macro
+
+REPEAT = 5
+
+
+def make_session(count):
+    # A recorded mouse session, mostly moves with a key press now and then
+    commands = []
+    for i in range(count):
+        if i % 500 == 0:
+            commands.append({"name": "Key A press", "type": "key", "time": i * 0.008, "keytype": "keycode",
+                             "value": 65, "press": i % 1000 == 0})
+        else:
+            commands.append({"name": f"Mouse Move to {i % 1920}, {i % 1080}", "type": "move", "time": i * 0.008,
+                             "x": i % 1920, "y": i % 1080, "absolute": True})
+    return commands
+
+
+def measure(fn):
+    best = None
+    for _ in range(REPEAT):
+        # Every load reads and parses the file, the parse cache would otherwise answer all but the first one
+        Macro.parse_cache.clear()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def bench(path, binary, commands):
+    store = JsonMacroStore(path, binary_commands=binary)
+    Macro.use_store(store)
+    store.write("session", {"name": "session", "description": "", "repeat": 1, "position": 0, "timing": True},
+                commands)
+    size = os.path.getsize(store.commands_path("session"))
+    load_ms = measure(lambda: Macro.load(f"{path}/session"))
+    first_ms = measure(lambda: Macro.load(f"{path}/session").commands[0])
+    all_ms = measure(lambda: list(Macro.load(f"{path}/session").commands))
+    return size, load_ms, first_ms, all_ms
+
+
+@click.command()
+@click.option('--commands', 'command_count', type=int, default=50000, help="Number of recorded commands.")
+def main(command_count):
+    commands = make_session(command_count)
+    workdir = tempfile.mkdtemp(prefix="macro_format_")
+    try:
+        results = {}
+        for name, binary in (("json", False), ("binary", True)):
+            os.makedirs(os.path.join(workdir, name))
+            results[name] = bench(os.path.join(workdir, name), binary, commands)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{command_count} recorded commands")
+    print(f"  {'format':<8} {'bytes':>10} {'load ms':>9} {'+ first ms':>11} {'+ all ms':>9}")
+    for name, (size, load_ms, first_ms, all_ms) in results.items():
+        print(f"  {name:<8} {size:>10} {load_ms:>9.1f} {first_ms:>11.1f} {all_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from server import codec
+
+CATALOG_SIZES = [100, 1000, 10000]
+REPEAT = 5
+
+
+def make_catalog(count):
+    macros = [{"name": f"Macro {i}", "description": f"Description of macro number {i}", "position": i,
+               "repeat": 1, "macro_id": f"Macro_{i}", "timing": i % 2 == 0} for i in range(count)]
+    return {"type": "macro-list", "data": {"macro_list": macros, "version": 1}}
+
+
+def measure(fn, *args):
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def bench_json(message):
+    data, encode_ms = measure(lambda: json.dumps(message).encode() + b"\n")
+    _, decode_ms = measure(lambda: json.loads(data[:-1]))
+    return len(data), encode_ms, decode_ms
+
+
+def bench_binary(message, method=None):
+    def encode():
+        payload = codec.encode(message)
+        if method is None:
+            return codec.encode_frame(payload)
+        return codec.encode_frame(codec.compress(payload, method), codec.FLAG_COMPRESSED)
+
+    def decode(frame):
+        length, flags = codec.FRAME_HEADER.unpack_from(frame)
+        payload = frame[codec.FRAME_HEADER.size:]
+        if flags & codec.FLAG_COMPRESSED:
+            payload = codec.decompress(payload, method, 1 << 30)
+        return codec.decode(payload)
+
+    data, encode_ms = measure(encode)
+    decoded, decode_ms = measure(decode, data)
+    assert decoded == message
+    return len(data), encode_ms, decode_ms
+
+
+def main():
+    print(f"{'macros':>8} {'format':<12} {'bytes':>10} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}")
+    for count in CATALOG_SIZES:
+        message = make_catalog(count)
+        results = [("json", bench_json(message)), ("binary", bench_binary(message))]
+        for method in codec.COMPRESSION_METHODS:
+            results.append((f"binary+{method}", bench_binary(message, method)))
+        json_size = results[0][1][0]
+        for name, (size, encode_ms, decode_ms) in results:
+            print(f"{count:>8} {name:<12} {size:>10} {size / json_size:>7.2f} {encode_ms:>10.2f} {decode_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+# Lets pynput import on machines without a display, only the key objects are created
+os.environ.setdefault("PYNPUT_BACKEND", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_commands_format import make_session
+from macro import JsonMacroStore, Macro, MacroCache
+
+INFO = {"description": "", "repeat": 1, "position": 0, "timing": True}
+
+
+def measure(macro_ids, rounds):
+    # ms per Macro.load() with the commands accessed, like a macro about to run
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for macro_id in macro_ids:
+            macro = Macro.load(f"macros/{macro_id}")
+            macro.commands[0]
+    return (time.perf_counter() - start) * 1000 / (rounds * len(macro_ids))
+
+
+@click.command()
+@click.option('--macros', 'macro_count', type=int, default=50, help="Number of macros loaded in turn.")
+@click.option('--commands', 'command_count', type=int, default=2000, help="Number of commands in every macro.")
+@click.option('--rounds', type=int, default=10, help="Times every macro is loaded.")
+def main(macro_count, command_count, rounds):
+    commands = make_session(command_count)
+    macro_ids = [f"macro_{i}" for i in range(macro_count)]
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="macro_parse_cache_")
+    results = {}
+    try:
+        for name, binary in (("json", False), ("binary", True)):
+            os.makedirs(os.path.join(workdir, name, "macros"))
+            # Macro finds its store by the relative path "macros"
+            os.chdir(os.path.join(workdir, name))
+            store = JsonMacroStore("macros", binary_commands=binary)
+            for macro_id in macro_ids:
+                store.write(macro_id, dict(INFO, name=macro_id), commands)
+            Macro.use_store(store)
+            for cache, max_bytes in (("off", 0), ("all", 2 ** 30), ("half", None)):
+                # Half of what all the macros take, the least recently used ones keep being evicted
+                Macro.parse_cache = MacroCache(max_bytes if max_bytes is not None else results[name, "all"][1] // 2)
+                load_ms = measure(macro_ids, rounds)
+                stats = Macro.parse_cache.stats()
+                results[name, cache] = load_ms, stats["bytes"], stats["hit_rate"], stats["evictions"]
+            os.chdir(cwd)
+            with Macro.stores_lock:
+                Macro.stores.clear()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{macro_count} macros of {command_count} commands loaded {rounds} times in turn")
+    print(f"  {'commands':<8} {'cache':<6} {'ms / load':>10} {'cache KiB':>10} {'hit rate':>9} {'evictions':>10}")
+    for (name, cache), (load_ms, size, hit_rate, evictions) in results.items():
+        print(f"  {name:<8} {cache:<6} {load_ms:>10.3f} {size / 1024:>10.0f} {hit_rate:>9.0%} {evictions:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from load_test import SERVER_PATH, make_macros
+
+
+def measure_startup(workdir, port, loop):
+    # Seconds from process start to the hello of the first accepted connection and to its first macro list
+    env = dict(os.environ)
+    env.setdefault("PYNPUT_BACKEND", "dummy")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SERVER_PATH, "-p", str(port), "--max-attempts", "1", "--loop", loop],
+                               cwd=workdir, env=env, stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+                break
+            except OSError:
+                time.sleep(0.001)
+        with sock:
+            file = sock.makefile("rb")
+            if json.loads(file.readline()) != {"type": "hello", "data": "accept"}:
+                raise RuntimeError("Connection wasn't accepted")
+            hello = time.perf_counter() - start
+            sock.sendall(b'{"type":"request-macros","data":""}\n')
+            while json.loads(file.readline())["type"] != "macro-list":
+                pass
+            macro_list = time.perf_counter() - start
+        return hello, macro_list
+    finally:
+        process.kill()
+        process.wait()
+
+
+@click.command()
+@click.option('--macros', 'macro_count', type=int, default=1000, help="Number of macros in the catalog.")
+@click.option('--runs', type=int, default=5, help="Number of server starts, the median and best are reported.")
+@click.option('--port', '-p', type=int, default=5990, help="First loopback port, every run uses the next one.")
+@click.option('--loop', type=click.Choice(['asyncio', 'selectors']), default='asyncio',
+              help="Server event loop implementation.")
+def main(macro_count, runs, port, loop):
+    workdir = tempfile.mkdtemp(prefix="macro_startup_")
+    try:
+        make_macros(os.path.join(workdir, "macros"), macro_count)
+        results = [measure_startup(workdir, port + i, loop) for i in range(runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    hello = [result[0] * 1000 for result in results]
+    macro_list = [result[1] * 1000 for result in results]
+    print(f"{macro_count} macros, {loop} loop, {runs} runs")
+    print(f"  {'':<22} {'median ms':>10} {'best ms':>10}")
+    print(f"  {'start to hello':<22} {statistics.median(hello):>10.1f} {min(hello):>10.1f}")
+    print(f"  {'start to macro list':<22} {statistics.median(macro_list):>10.1f} {min(macro_list):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
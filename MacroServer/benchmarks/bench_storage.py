@@ -0,0 +1,67 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from macro import JsonMacroStore, SqliteMacroStore
+
+
+def make_macro(i, command_count):
+    info = {"name": f"Macro {i}", "description": f"Description of macro number {i}", "repeat": 1, "position": i,
+            "timing": True}
+    commands = [{"name": "Delay", "type": "delay", "time": j * 0.1, "delay": 0.05} if j % 2 else
+                {"name": "Key", "type": "key", "time": j * 0.1, "keytype": "keycode", "value": 65, "press": j % 4 == 0}
+                for j in range(command_count)]
+    return f"Macro_{i}", info, commands
+
+
+def measure(fn, count=1):
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return (time.perf_counter() - start) * 1000 / count
+
+
+def bench(store, macros, operations):
+    ids = [macro_id for macro_id, _, _ in macros]
+    picked = random.Random(1).sample(range(len(macros)), operations)
+    results = {"write all": measure(lambda i: [store.write(*macro) for macro in macros]),
+               "list info": measure(lambda i: store.list_info(), 5),
+               "read one": measure(lambda i: (store.read_info(ids[picked[i]]), store.read_commands(ids[picked[i]])),
+                                   operations),
+               "write one": measure(lambda i: store.write(*macros[picked[i]]), operations),
+               "rename one": measure(lambda i: store.replace(ids[picked[i]], f"{ids[picked[i]]}_renamed",
+                                                             *macros[picked[i]][1:]), operations),
+               "layout of all": measure(lambda i: store.save_layout({macro_id: len(ids) - position
+                                                                     for position, macro_id in enumerate(ids)}), 5)}
+    store.close()
+    return results
+
+
+@click.command()
+@click.option('--macros', 'macro_count', type=int, default=2000, help="Number of macros in the store.")
+@click.option('--commands', 'command_count', type=int, default=50, help="Number of commands in every macro.")
+@click.option('--operations', type=int, default=200, help="Number of single macro reads, writes and renames.")
+def main(macro_count, command_count, operations):
+    macros = [make_macro(i, command_count) for i in range(macro_count)]
+    workdir = tempfile.mkdtemp(prefix="macro_storage_")
+    try:
+        os.makedirs(os.path.join(workdir, "json"))
+        results = {"json": bench(JsonMacroStore(os.path.join(workdir, "json")), macros, operations),
+                   "sqlite": bench(SqliteMacroStore(os.path.join(workdir, "sqlite")), macros, operations)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{macro_count} macros with {command_count} commands, times in ms per operation")
+    print(f"  {'operation':<16} {'json':>10} {'sqlite':>10}")
+    for operation in results["json"]:
+        print(f"  {operation:<16} {results['json'][operation]:>10.3f} {results['sqlite'][operation]:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
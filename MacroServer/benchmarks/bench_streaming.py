@@ -0,0 +1,100 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+# Lets pynput import on machines without a display, only the key objects are created
+os.environ.setdefault("PYNPUT_BACKEND", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_commands_format import make_session
+from macro import JsonMacroStore, Macro, NullController, SqliteMacroStore
+
+INFO = {"name": "session", "description": "", "repeat": 1, "position": 0, "timing": False}
+
+
+class Stop(Exception):
+    pass
+
+
+def loaded_macro():
+    # Every command decoded into a list before playing, what execute() did before streaming
+    macro = Macro.load("macros/session")
+    macro.commands = list(macro.commands)
+    return macro
+
+
+def streamed_macro():
+    # Only the info, execute() reads the commands from the store
+    return Macro(INFO["name"], INFO["description"], [], INFO["repeat"], INFO["position"], INFO["timing"])
+
+
+def play(make, trace):
+    # Returns the ms from the start to the first command sent, or with trace the peak of the memory allocated while
+    # the whole macro plays, tracing slows the decoding down too much to time it
+    first = []
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+
+    def progress(index, total, elapsed):
+        if index == 1:
+            first.append((time.perf_counter() - start) * 1000)
+            if not trace:
+                raise Stop()
+
+    macro = make()
+    try:
+        macro.execute(progress)
+    except Stop:
+        pass
+    if not trace:
+        return first[0]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench(store, commands):
+    store.write("session", INFO, commands)
+    Macro.use_store(store)
+    results = {}
+    for name, make in (("loaded", loaded_macro), ("streamed", streamed_macro)):
+        results[name] = min(play(make, False) for _ in range(3)), play(make, True)
+    store.close()
+    return results
+
+
+@click.command()
+@click.option('--commands', 'command_count', type=int, default=200000, help="Number of recorded commands.")
+def main(command_count):
+    Macro.keyboard_controller = NullController
+    Macro.mouse_controller = NullController
+    commands = make_session(command_count)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="macro_streaming_")
+    results = {}
+    try:
+        for name, store_class in (("json", JsonMacroStore), ("sqlite", SqliteMacroStore)):
+            os.makedirs(os.path.join(workdir, name, "macros"))
+            # Macro finds its store by the relative path "macros"
+            os.chdir(os.path.join(workdir, name))
+            results[name] = bench(store_class("macros"), commands)
+            with Macro.stores_lock:
+                Macro.stores.clear()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{command_count} recorded commands played without timing")
+    print(f"  {'store':<8} {'playback':<10} {'first command ms':>17} {'peak KiB':>9}")
+    for store, modes in results.items():
+        for mode, (first_ms, peak) in modes.items():
+            print(f"  {store:<8} {mode:<10} {first_ms:>17.2f} {peak / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
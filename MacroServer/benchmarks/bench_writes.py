@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_commands_format import make_session
+from macro import JsonMacroStore, SqliteMacroStore, WriteBehindStore
+
+INFO = {"name": "session", "description": "", "repeat": 1, "position": 0, "timing": True}
+
+
+def bench(store, commands, saves):
+    # ms the caller waits per save and per layout change, like the editor saving and the layout being dragged
+    start = time.perf_counter()
+    for i in range(saves):
+        store.write("session", dict(INFO, description=str(i)), commands)
+    save_ms = (time.perf_counter() - start) * 1000 / saves
+    start = time.perf_counter()
+    for i in range(saves):
+        store.save_layout({"session": i})
+    layout_ms = (time.perf_counter() - start) * 1000 / saves
+    start = time.perf_counter()
+    store.close()
+    return save_ms, layout_ms, (time.perf_counter() - start) * 1000
+
+
+@click.command()
+@click.option('--commands', 'command_count', type=int, default=5000, help="Number of commands in the saved macro.")
+@click.option('--saves', type=int, default=50, help="Number of saves and layout changes in a row.")
+def main(command_count, saves):
+    commands = make_session(command_count)
+    workdir = tempfile.mkdtemp(prefix="macro_writes_")
+    results = {}
+    try:
+        for name, make in (("json", lambda path: JsonMacroStore(path)),
+                           ("json behind", lambda path: WriteBehindStore(JsonMacroStore(path))),
+                           ("sqlite", lambda path: SqliteMacroStore(path)),
+                           ("sqlite behind", lambda path: WriteBehindStore(SqliteMacroStore(path)))):
+            path = os.path.join(workdir, name.replace(" ", "_"), "macros")
+            os.makedirs(path)
+            results[name] = bench(make(path), commands, saves)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"{saves} saves of a macro with {command_count} commands and {saves} layout changes, ms the caller waits")
+    print(f"  {'store':<14} {'per save':>9} {'per layout':>11} {'close':>8}")
+    for name, (save_ms, layout_ms, close_ms) in results.items():
+        print(f"  {name:<14} {save_ms:>9.3f} {layout_ms:>11.3f} {close_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
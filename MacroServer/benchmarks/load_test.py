@@ -0,0 +1,212 @@
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import click
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "macro_server.py")
+# Relative weights of the operations a simulated client performs
+OPERATIONS = [("heartbeat", 50), ("request-macros", 20), ("execute-stop", 25), ("set-layout", 5)]
+
+
+def make_macros(path, count):
+    # Every macro presses its own key, so the macros don't conflict with each other
+    os.makedirs(path)
+    for i in range(count):
+        info = {"name": f"load_{i}", "description": "Load test macro", "repeat": 1, "position": i, "timing": False}
+        commands = {"commands": [
+            {"name": "Delay", "type": "delay", "time": 0, "delay": 0.05},
+            {"name": "Key press", "type": "key", "time": 0, "keytype": "keycode", "value": 1000 + i, "press": True},
+            {"name": "Key release", "type": "key", "time": 0, "keytype": "keycode", "value": 1000 + i, "press": False}]}
+        with open(os.path.join(path, f"load_{i}.json"), "w") as file:
+            json.dump(info, file)
+        with open(os.path.join(path, f"load_{i}.commands.json"), "w") as file:
+            json.dump(commands, file)
+
+
+class SimulatedClient:
+    def __init__(self, port, index, macro_count, seed):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.settimeout(10)
+        self.file = self.sock.makefile("rb")
+        self.macro_id = f"load_{index}"
+        self.macro_count = macro_count
+        self.random = random.Random(seed)
+        self.latencies = {}
+        self.errors = 0
+        self.read_until(lambda msg: msg["type"] == "hello")
+
+    def send(self, msg_type, msg_data=""):
+        self.sock.sendall(json.dumps({"type": msg_type, "data": msg_data}, separators=(",", ":")).encode() + b"\n")
+
+    def read_until(self, match):
+        # Broadcasts caused by the other clients are skipped
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection")
+            msg = json.loads(line)
+            if match(msg):
+                return msg
+
+    def request(self, name, msg_type, msg_data, match):
+        start = time.perf_counter()
+        self.send(msg_type, msg_data)
+        msg = self.read_until(match)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        return msg
+
+    def is_mine(self, msg, types):
+        data = msg.get("data")
+        if isinstance(data, dict):
+            data = data.get("macro_id")
+        return msg["type"] in types and data == self.macro_id
+
+    def heartbeat(self):
+        self.request("heartbeat", "heartbeat", "ping", lambda msg: msg == {"type": "heartbeat", "data": "pong"})
+
+    def request_macros(self):
+        self.request("request-macros", "request-macros", "", lambda msg: msg["type"] == "macro-list")
+
+    def execute_stop(self):
+        self.request("execute-macro", "execute-macro", self.macro_id,
+                     lambda msg: self.is_mine(msg, ("macro-started", "macro-queued", "macro-already-running")))
+        msg = self.request("stop-macro", "stop-macro", self.macro_id,
+                           lambda msg: self.is_mine(msg, ("macro-stopped",)) or msg["type"] == "error")
+        if msg["type"] == "error" and msg["data"] != "No macro running":
+            self.errors += 1
+
+    def set_layout(self):
+        # The sender gets no reply, the ping after it comes back once the layout is saved
+        positions = list(range(self.macro_count))
+        self.random.shuffle(positions)
+        layout = [{"macro_id": f"load_{i}", "position": p} for i, p in enumerate(positions)]
+        start = time.perf_counter()
+        self.send("set-layout", json.dumps(layout))
+        self.send("heartbeat", "ping")
+        self.read_until(lambda msg: msg == {"type": "heartbeat", "data": "pong"} or msg["type"] == "error")
+        self.latencies.setdefault("set-layout", []).append(time.perf_counter() - start)
+
+    def run(self, deadline):
+        names, weights = zip(*OPERATIONS)
+        actions = {"heartbeat": self.heartbeat, "request-macros": self.request_macros,
+                   "execute-stop": self.execute_stop, "set-layout": self.set_layout}
+        try:
+            while time.perf_counter() < deadline:
+                actions[self.random.choices(names, weights)[0]]()
+        except Exception as e:
+            print(f"Client {self.macro_id} failed: {e}")
+            self.errors += 1
+        finally:
+            self.sock.close()
+
+
+def read_process_stats(pid):
+    # (cpu seconds, rss bytes) from /proc, None where it isn't available
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as file:
+            rss = next(int(line.split()[1]) * 1024 for line in file if line.startswith("VmRSS:"))
+        return cpu, rss
+    except (OSError, ValueError, StopIteration):
+        return None, None
+
+
+def start_server(workdir, port, loop):
+    env = dict(os.environ)
+    # Lets pynput import on machines without a display, the null backend never uses it
+    env.setdefault("PYNPUT_BACKEND", "dummy")
+    process = subprocess.Popen([sys.executable, SERVER_PATH, "-p", str(port), "--max-attempts", "1",
+                                "--loop", loop, "--input-backend", "null", "--flood-rate", "0",
+                                # All simulated clients share one address and are meant to go as fast as they can
+                                "--rate-limit", "catalog=0", "--rate-limit", "execute=0",
+                                "--rate-limit", "layout=0", "--rate-limit", "stats=0"],
+                               cwd=workdir, env=env, stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as sock:
+                sock.recv(1024)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server didn't start")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_round(port, loop, client_count, duration, macro_count):
+    workdir = tempfile.mkdtemp(prefix="macro_load_")
+    process = None
+    try:
+        make_macros(os.path.join(workdir, "macros"), macro_count)
+        process = start_server(workdir, port, loop)
+        clients = [SimulatedClient(port, i % macro_count, macro_count, i) for i in range(client_count)]
+        cpu_start, rss_peak = read_process_stats(process.pid)
+        start = time.perf_counter()
+        deadline = start + duration
+        threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.2)
+            _, rss = read_process_stats(process.pid)
+            if rss is not None:
+                rss_peak = max(rss_peak or 0, rss)
+        elapsed = time.perf_counter() - start
+        cpu_end, _ = read_process_stats(process.pid)
+    finally:
+        if process is not None:
+            process.kill()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = {}
+    for client in clients:
+        for name, values in client.latencies.items():
+            latencies.setdefault(name, []).extend(values)
+    total = sum(len(values) for values in latencies.values())
+    cpu = (cpu_end - cpu_start) / elapsed * 100 if cpu_start is not None and cpu_end is not None else None
+    return {"requests": total, "throughput": total / elapsed, "cpu": cpu, "rss": rss_peak,
+            "errors": sum(client.errors for client in clients), "latencies": latencies}
+
+
+@click.command()
+@click.option('--clients', default="1,10,50", help="Comma separated numbers of simulated clients, one round each.")
+@click.option('--duration', type=float, default=10, help="Seconds every round runs.")
+@click.option('--macros', 'macro_count', type=int, default=50,
+              help="Number of macros in the catalog, clients above this count share macros.")
+@click.option('--port', '-p', type=int, default=5990, help="Loopback port for the server under test.")
+@click.option('--loop', type=click.Choice(['asyncio', 'selectors']), default='asyncio',
+              help="Server event loop implementation.")
+def main(clients, duration, macro_count, port, loop):
+    for client_count in [int(count) for count in clients.split(",")]:
+        result = run_round(port, loop, client_count, duration, macro_count)
+        cpu = f"{result['cpu']:.1f} %" if result["cpu"] is not None else "n/a"
+        rss = f"{result['rss'] / 1024 / 1024:.1f} MiB" if result["rss"] is not None else "n/a"
+        print(f"\n{client_count} clients, {loop} loop: {result['throughput']:.0f} requests/s, "
+              f"server CPU {cpu}, peak RSS {rss}, errors {result['errors']}")
+        print(f"  {'message':<16} {'count':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, values in sorted(result["latencies"].items()):
+            print(f"  {name:<16} {len(values):>8} {percentile(values, 0.5) * 1000:>8.2f} "
+                  f"{percentile(values, 0.99) * 1000:>8.2f}")
+        port += 1  # The previous port may still be in TIME_WAIT
+
+
+if __name__ == "__main__":
+    main()
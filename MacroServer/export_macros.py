@@ -0,0 +1,30 @@
+import os
+
+import click
+
+from macro import JsonMacroStore, Macro, command_codec
+
+
+@click.command()
+@click.argument('target', type=click.Path(file_okay=False))
+@click.argument('macro_ids', nargs=-1)
+@click.option('--path', default="macros", help="Directory of the macros, the database next to it is used if it exists.")
+def main(target, macro_ids, path):
+    # Writes the macros as <macro_id>.json and <macro_id>.commands.json, all of them if no ids are given
+    source = Macro.get_store(path)
+    exported = JsonMacroStore(target, binary_commands=False)
+    os.makedirs(target, exist_ok=True)
+    if not macro_ids:
+        macro_ids = [macro_id for macro_id, _ in source.list_info()]
+    count = 0
+    for macro_id in macro_ids:
+        try:
+            exported.write(macro_id, source.read_info(macro_id), command_codec.to_dicts(source.read_commands(macro_id)))
+            count += 1
+        except Exception as e:
+            print(f"Could not export {macro_id}: {e}")
+    print(f"Exported {count} macros to {target}.")
+
+
+if __name__ == "__main__":
+    main()
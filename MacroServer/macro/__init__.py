@@ -1,5 +1,21 @@
+from . import command_codec
 from .macro import Macro
-from .macro_recorder import InputRecorder, InputRecorderOptions
+from .catalog import MacroCatalog
+from .cache import MacroCache
+from .layout import LayoutIndex
+from .null_input import NullController
+from .storage import MacroStore, JsonMacroStore, SqliteMacroStore, WriteBehindStore
+from .watcher import MacroWatcher
 
-__all__ = ["Macro", "InputRecorder", "InputRecorderOptions"]
+__all__ = ["command_codec", "Macro", "MacroCatalog", "MacroCache", "LayoutIndex", "NullController", "MacroStore",
+           "JsonMacroStore", "SqliteMacroStore", "WriteBehindStore", "MacroWatcher",
+           "InputRecorder", "InputRecorderOptions"]
+
+
+def __getattr__(name):
+    # The recorder starts pynput listeners, it is imported only by the editor when it's needed
+    if name in ("InputRecorder", "InputRecorderOptions"):
+        from . import macro_recorder
+        return getattr(macro_recorder, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -0,0 +1,124 @@
+import os
+import sys
+import threading
+import types
+
+from collections import OrderedDict
+
+from .command_codec import CommandList
+
+PARSED_COMMAND_SIZE = 256  # Bytes of a command parsed from JSON with its key or button, measured with tracemalloc
+
+
+class MacroCache:
+    # Parsed macros of the whole process, Macro.load() returns new Macro objects over the shared entries
+    # (directory, macro_id) -> (stamp, info, commands, size, resources), least recently used first
+    # The entries are shared, so the info is read-only and the commands are a CommandList or a tuple of commands
+    # the records can't hold, Macro.load() hands out copies that decode or copy their own Command objects
+    # resources are the macro's input resources, None until set_resources() stores them
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(path, macro_id):
+        return os.path.normpath(path), macro_id
+
+    @staticmethod
+    def size_of(info, commands):
+        # An estimate, counting every object the entry holds would cost more than parsing small macros
+        size = sum(sys.getsizeof(value) for value in info.values()) + sys.getsizeof(info)
+        if isinstance(commands, CommandList):
+            # The records and the string table, only copies of the list decode commands
+            return size + len(commands.records) + sum(len(text) for text in commands.strings)
+        return size + sys.getsizeof(commands) + PARSED_COMMAND_SIZE * len(commands)
+
+    def get(self, key, stamp, count=True):
+        # Returns (info, commands) if the entry was parsed with the same stamp, count=False is for warming up
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry[1], entry[2]
+            if count:
+                self.misses += 1
+            if entry is not None:
+                self.remove(key)
+        return None
+
+    def put(self, key, stamp, info, commands):
+        # Returns the (info, commands) to use, they are read-only from then on
+        info = types.MappingProxyType(dict(info))
+        if not isinstance(commands, CommandList):
+            commands = tuple(commands)
+        size = self.size_of(info, commands)
+        if size > self.max_bytes:
+            return info, commands
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (stamp, info, commands, size, None)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+        return info, commands
+
+    def get_resources(self, key, stamp):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[4] if entry is not None and entry[0] == stamp else None
+
+    def set_resources(self, key, stamp, resources):
+        # Kept only while the entry is parsed from the same stamp, the resources are computed from its commands
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.entries[key] = entry[:4] + (resources,)
+
+    def remove(self, key):
+        # Called with the lock held
+        self.bytes -= self.entries.pop(key)[3]
+
+    def invalidate(self, path, macro_id=None):
+        # Drops the macro, or every macro of the directory if macro_id is None
+        path = os.path.normpath(path)
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == path and macro_id in (None, key[1])]
+            for key in keys:
+                self.remove(key)
+            self.invalidations += len(keys)
+
+    def is_full(self):
+        return self.bytes >= self.max_bytes
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": self.hit_rate(), "evictions": self.evictions,
+                    "invalidations": self.invalidations}
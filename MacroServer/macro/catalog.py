@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+import uuid
+
+from collections import deque
+from contextlib import contextmanager
+
+from .macro import Macro
+
+
+class MacroCatalog:
+    def __init__(self, path="macros", max_history=4096, on_load=None):
+        self.path = path
+        self.on_load = on_load  # Called with the seconds a full reload took
+        self.macros: dict[str, dict] = None
+        self.stamps: dict[str, object] = {}  # Store stamps the macros were read with, see refresh()
+        self.encoded: dict[object, bytes] = {}
+        self.lock = threading.RLock()
+        self.version = 0
+        # Versions restart with every run, a client's version is only valid together with the epoch it came with
+        self.epoch = uuid.uuid4().hex
+        # (version, kind, macro_id, info) - kind is "added", "changed" or "removed", info holds the full info
+        # of added macros and only the changed fields of changed ones
+        self.history = deque(maxlen=max_history)
+        self.history_start = 0  # Oldest version a delta can be computed from
+        self.batch_depth = 0
+        self.batch_version = None
+        Macro.add_change_listener(self.on_macro_changed)
+
+    def close(self):
+        Macro.remove_change_listener(self.on_macro_changed)
+
+    def load(self):
+        # The directory is read without the lock, lookups only wait for the new maps to be swapped in
+        start = time.perf_counter()
+        # Taken first, a macro changed during the listing is read again by the next refresh()
+        stamps = self.read_stamps()
+        macros_info = Macro.get_all_macros_info(self.path)["macro_list"]
+        with self.lock:
+            self.stamps = stamps
+            self.macros = {info["macro_id"]: info for info in macros_info}
+            self.encoded.clear()
+            # Deltas can't be computed across a full reload
+            self.version += 1
+            self.history.clear()
+            self.history_start = self.version
+        if self.on_load is not None:
+            self.on_load(time.perf_counter() - start)
+
+    @contextmanager
+    def loaded(self):
+        # Holds the lock with the macros loaded
+        while True:
+            with self.lock:
+                if self.macros is not None:
+                    yield self.macros
+                    return
+            self.load()
+
+    def invalidate(self):
+        with self.lock:
+            self.macros = None
+            self.encoded.clear()
+
+    def read_stamps(self):
+        try:
+            return Macro.get_store(self.path).stamps()
+        except Exception as e:
+            print(f"Could not read macro stamps: {e}")
+            return {}
+
+    def refresh(self):
+        # Picks up what other processes changed, like the manager saving a macro, without reading everything again
+        # Returns True if the catalog changed
+        # The stamps and changed macros are read without the lock, it's only taken to apply them
+        if self.macros is None:
+            return False
+        old_stamps = self.stamps
+        stamps = self.read_stamps()
+        changed = [macro_id for macro_id in stamps.keys() | old_stamps.keys()
+                   if stamps.get(macro_id) != old_stamps.get(macro_id)]
+        positions = Macro.get_store(self.path).load_layout()
+        infos = {macro_id: self.read_info(macro_id, positions) for macro_id in changed}
+        with self.lock:
+            if self.macros is None or self.stamps is not old_stamps:
+                return False  # Reloaded meanwhile, the reload has newer data
+            version = self.version
+            self.stamps = stamps
+            with self.batch():
+                for macro_id, info in infos.items():
+                    self.apply_info(macro_id, info)
+                self.apply_layout(positions)
+            changed_catalog = self.version != version
+        for macro_id in changed:
+            # The parse cache and other listeners learn about it as if this process changed it
+            Macro.notify_change(self.path, macro_id, self.on_macro_changed)
+        return changed_catalog
+
+    def get_macros(self):
+        with self.loaded() as macros:
+            return {"macro_list": list(macros.values()), "version": self.version, "epoch": self.epoch}
+
+    def get_macro_info(self, macro_id):
+        with self.loaded() as macros:
+            return macros.get(macro_id)
+
+    def get_encoded(self, key, encode):
+        # Keeps the encoded message ready, encode(data) is only called after a change
+        with self.loaded():
+            if key not in self.encoded:
+                self.encoded[key] = encode(self.get_macros())
+            return self.encoded[key]
+
+    def get_delta(self, since, epoch):
+        # Returns None if the version is from another run, the history doesn't reach back to it or a full list
+        # would be as small
+        with self.loaded():
+            if epoch != self.epoch:
+                return None
+            if since == self.version:
+                return {"version": self.version, "epoch": self.epoch, "added": [], "removed": [], "changed": []}
+            if since > self.version or since < self.history_start:
+                return None
+
+            added = {}
+            removed = set()
+            changed = {}
+            for version, kind, macro_id, info in self.history:
+                if version <= since:
+                    continue
+                if kind == "removed":
+                    if added.pop(macro_id, None) is None:
+                        removed.add(macro_id)
+                    changed.pop(macro_id, None)
+                elif kind == "added":
+                    if macro_id in removed:
+                        # The client still has the old one, replace it completely
+                        removed.discard(macro_id)
+                        changed[macro_id] = dict(info)
+                    else:
+                        added[macro_id] = dict(info)
+                elif macro_id in added:
+                    added[macro_id].update(info)
+                else:
+                    changed.setdefault(macro_id, {}).update(info)
+
+            if len(added) + len(removed) + len(changed) >= len(self.macros):
+                return None
+            return {"version": self.version, "epoch": self.epoch, "added": list(added.values()),
+                    "removed": list(removed),
+                    "changed": [{"macro_id": macro_id, **fields} for macro_id, fields in changed.items()]}
+
+    @contextmanager
+    def batch(self):
+        # All changes made inside the block share one version
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self.batch_version = None
+
+    def next_version(self):
+        if self.batch_depth and self.batch_version is not None:
+            return self.batch_version
+        self.version += 1
+        if self.batch_depth:
+            self.batch_version = self.version
+        return self.version
+
+    def record(self, kind, macro_id, info):
+        version = self.next_version()
+        if len(self.history) == self.history.maxlen:
+            # Changes of this version are about to be incomplete
+            self.history_start = self.history[0][0]
+        self.history.append((version, kind, macro_id, info))
+
+    def apply_layout(self, positions):
+        # Called with the lock held
+        with self.batch():
+            for macro_id, info in self.macros.items():
+                position = positions.get(macro_id, info["position"])
+                if position != info["position"]:
+                    self.macros[macro_id] = {**info, "position": position}
+                    self.record("changed", macro_id, {"position": position})
+                    self.encoded.clear()
+
+    def read_info(self, macro_id, positions=None):
+        try:
+            return Macro.read_info(macro_id, self.path, positions)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Could not read macro {macro_id}: {e}")
+            return None
+
+    def apply_info(self, macro_id, new):
+        # Called with the lock held, new is None if the macro is gone
+        old = self.macros.get(macro_id)
+        if new == old:
+            return
+        self.encoded.clear()
+        if new is None:
+            self.macros.pop(macro_id, None)
+            self.record("removed", macro_id, None)
+        elif old is None:
+            self.macros[macro_id] = new
+            self.record("added", macro_id, dict(new))
+        else:
+            self.macros[macro_id] = new
+            fields = {key: value for key, value in new.items() if old.get(key) != value}
+            self.record("changed", macro_id, fields)
+
+    def on_macro_changed(self, path, macro_id):
+        if os.path.normpath(path) != os.path.normpath(self.path):
+            return
+        if self.macros is None:
+            return  # Nothing loaded yet, the next request reads the directory anyway
+        if macro_id is None:
+            positions = Macro.get_store(self.path).load_layout()
+            with self.lock:
+                if self.macros is not None:
+                    self.apply_layout(positions)
+            return
+        info = self.read_info(macro_id)
+        with self.lock:
+            if self.macros is not None:
+                self.apply_info(macro_id, info)
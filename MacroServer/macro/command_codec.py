@@ -0,0 +1,239 @@
+import json
+import struct
+
+from .commands import *
+
+# Binary commands file: header, fixed size records, a table of the strings the records point to and the generation
+# Header: magic, version, record size, number of records
+MAGIC = b"MCMD"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+# Record: type code, flags, value, x, y, time - value is a key code, delay in ms or an index to the string table
+RECORD = struct.Struct("<BBxxiiid")
+STRING_LENGTH = struct.Struct("<I")
+# Generation of the save the file belongs to, the info file of the macro has the same one, older files end without it
+GENERATION = struct.Struct("<Q")
+
+TYPE_CODES = {"key": 1, "delay": 2, "click": 3, "move": 4, "scroll": 5, "textinput": 6}
+FLAG_PRESS = 1
+FLAG_ABSOLUTE = 2
+FLAG_NAMED_KEY = 4  # The value is the index of a pynput Key name instead of a key code
+
+INT32_RANGE = range(-2 ** 31, 2 ** 31)
+READ_AHEAD = 256  # Records a CommandStream reads from the file at once
+
+
+class CommandList:
+    # Read-only list of commands over the encoded records, a command is decoded the first time it's accessed
+    def __init__(self, records, count, strings):
+        self.records = records
+        self.count = count
+        self.strings = strings
+        self.decoded = None  # Commands this list decoded, allocated on the first access
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("command index out of range")
+        if self.decoded is None:
+            self.decoded = [None] * self.count
+        command = self.decoded[index]
+        if command is None:
+            command = self.decoded[index] = decode_record(self.records, index * RECORD.size, self.strings)
+        return command
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def stream(self):
+        # Iterates without keeping the decoded commands, a long macro is played without growing in memory
+        decoded = self.decoded
+        for i in range(self.count):
+            command = decoded[i] if decoded is not None else None
+            yield command if command is not None else decode_record(self.records, i * RECORD.size, self.strings)
+
+    def copy(self):
+        # Copies share the records but decode their own commands, editing a command of one doesn't change the other
+        return CommandList(self.records, self.count, self.strings)
+
+    def distinct(self):
+        # One command for every distinct type, flags and value, the inputs a macro uses don't depend on the rest
+        first = {}
+        for i, (type_code, flags, value, _, _, _) in enumerate(RECORD.iter_unpack(self.records)):
+            first.setdefault((type_code, flags, value), i)
+        return [self[i] for i in first.values()]
+
+
+class CommandStream:
+    # Commands decoded from binary records while they are played, only READ_AHEAD of them are decoded at once
+    # file is anything with read() and seek(), the stores hand over the records in memory or an open blob
+    def __init__(self, file, read_ahead=READ_AHEAD, owner=None):
+        self.file = file
+        self.read_ahead = read_ahead
+        self.owner = owner  # Closed with the file, like the connection a blob was opened on
+        self.count = read_header(file.read(HEADER.size))
+        file.seek(HEADER.size + self.count * RECORD.size)
+        self.strings = decode_strings(memoryview(file.read()), 0)[0]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # Every iteration starts from the first command, for macros that repeat
+        self.file.seek(HEADER.size)
+        remaining = self.count
+        while remaining:
+            chunk = self.file.read(min(remaining, self.read_ahead) * RECORD.size)
+            if not chunk or len(chunk) % RECORD.size:
+                raise ValueError("Binary commands file is truncated")
+            for offset in range(0, len(chunk), RECORD.size):
+                yield decode_record(chunk, offset, self.strings)
+            remaining -= len(chunk) // RECORD.size
+
+    def close(self):
+        self.file.close()
+        if self.owner is not None:
+            self.owner.close()
+
+
+def is_binary(data) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def coordinate(value):
+    # Raises ValueError for what the records can't hold, the caller keeps such macros in JSON
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, int) or value not in INT32_RANGE:
+        raise ValueError(f"Value {value} doesn't fit the binary commands format")
+    return value
+
+
+def encode(commands, generation=0) -> bytes:
+    # commands are the dicts of Command.__dict__(), the command names are not stored as they are generated
+    strings = {}
+
+    def string(text):
+        return strings.setdefault(text, len(strings))
+
+    data = bytearray(HEADER.size + RECORD.size * len(commands))
+    HEADER.pack_into(data, 0, MAGIC, VERSION, RECORD.size, len(commands))
+    for i, command in enumerate(commands):
+        command_type = command["type"]
+        flags = 0
+        value = x = y = 0
+        if command_type == "key":
+            flags = FLAG_PRESS if command["press"] else 0
+            if command["keytype"] == "key":
+                flags |= FLAG_NAMED_KEY
+                value = string(command["value"])
+            elif command["keytype"] == "keycode":
+                value = coordinate(command["value"])
+            else:
+                raise ValueError(f"Unknown key type: {command['keytype']}")
+        elif command_type == "delay":
+            value = coordinate(round(command["delay"] * 1000))
+        elif command_type in ("click", "move"):
+            flags = FLAG_ABSOLUTE if command["absolute"] else 0
+            if command_type == "click":
+                flags |= FLAG_PRESS if command["press"] else 0
+                value = string(json.dumps(command["button"]))
+            x, y = coordinate(command["x"]), coordinate(command["y"])
+        elif command_type == "scroll":
+            x, y = coordinate(command["x"]), coordinate(command["y"])
+        elif command_type == "textinput":
+            value = string(command["text"])
+        else:
+            raise ValueError(f"Unknown command type: {command_type}")
+        RECORD.pack_into(data, HEADER.size + i * RECORD.size, TYPE_CODES[command_type], flags, value, x, y,
+                         command["time"])
+
+    data += STRING_LENGTH.pack(len(strings))
+    for text in strings:
+        encoded = text.encode()
+        data += STRING_LENGTH.pack(len(encoded))
+        data += encoded
+    data += GENERATION.pack(generation)
+    return bytes(data)
+
+
+def decode(data) -> CommandList:
+    # Only the header and the string table are read here, the records stay in the buffer until accessed
+    view = memoryview(data)
+    count = read_header(view[:HEADER.size])
+    records_end = HEADER.size + count * RECORD.size
+    return CommandList(view[HEADER.size:records_end], count, decode_strings(view, records_end)[0])
+
+
+def read_generation(data):
+    # None for files written before the generation was stored
+    view = memoryview(data)
+    count = read_header(view[:HEADER.size])
+    offset = decode_strings(view, HEADER.size + count * RECORD.size)[1]
+    if len(view) < offset + GENERATION.size:
+        return None
+    return GENERATION.unpack_from(view, offset)[0]
+
+
+def read_header(header):
+    # Returns the number of records
+    if len(header) < HEADER.size or not is_binary(header):
+        raise ValueError("Not a binary commands file")
+    magic, version, record_size, count = HEADER.unpack_from(header)
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"Unsupported binary commands version {version}")
+    return count
+
+
+def decode_strings(view, offset):
+    # Returns the strings and the offset after them
+    try:
+        (string_count,) = STRING_LENGTH.unpack_from(view, offset)
+        offset += STRING_LENGTH.size
+        strings = []
+        for _ in range(string_count):
+            (length,) = STRING_LENGTH.unpack_from(view, offset)
+            offset += STRING_LENGTH.size
+            strings.append(str(view[offset:offset + length], "utf-8"))
+            offset += length
+    except struct.error:
+        raise ValueError("Binary commands file is truncated")
+    return strings, offset
+
+
+def decode_record(records, offset, strings):
+    import pynput
+    type_code, flags, value, x, y, time = RECORD.unpack_from(records, offset)
+    press = bool(flags & FLAG_PRESS)
+    absolute = bool(flags & FLAG_ABSOLUTE)
+    if type_code == TYPE_CODES["key"]:
+        if flags & FLAG_NAMED_KEY:
+            key = getattr(pynput.keyboard.Key, strings[value])
+        else:
+            key = pynput.keyboard.KeyCode.from_vk(value)
+        return KeyCommand(key, press, time)
+    if type_code == TYPE_CODES["delay"]:
+        return Delay(value / 1000, time)
+    if type_code == TYPE_CODES["click"]:
+        button = json.loads(strings[value])
+        button = pynput.mouse.Button(tuple(button) if isinstance(button, list) else button)
+        return MouseClick(button, press, x, y, absolute, time)
+    if type_code == TYPE_CODES["move"]:
+        return MouseMove(x, y, absolute, time)
+    if type_code == TYPE_CODES["scroll"]:
+        return MouseScroll(x, y, time)
+    if type_code == TYPE_CODES["textinput"]:
+        return TextInput(strings[value], time)
+    raise ValueError(f"Unknown command type code: {type_code}")
+
+
+def to_dicts(commands):
+    # Command dicts for writing, whether the commands were read from JSON or from a binary file
+    return [command if isinstance(command, dict) else command.__dict__() for command in commands]
@@ -7,6 +7,10 @@ class Command:
     def execute(self):
         raise NotImplementedError
 
+    def copy(self):
+        # A separate command with the same values, editing one doesn't change the other
+        raise NotImplementedError
+
     def __str__(self, controller=None):
         return f"{self.name} at {self.time}"
 
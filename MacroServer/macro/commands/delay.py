@@ -17,6 +17,11 @@ class Delay(Command):
             self.time = time
         self.name = f"Delay {self.delay}"
 
+    def copy(self):
+        command = Delay(self.delay, self.time)
+        command.name = self.name
+        return command
+
     def execute(self, controller=None):
         time.sleep(self.delay)
 
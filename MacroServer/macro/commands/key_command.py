@@ -1,11 +1,16 @@
-import pynput
-from typing import Union
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Union
 
 from .command import Command
 
+if TYPE_CHECKING:
+    import pynput
+
 
 class KeyCommand(Command):
     def __init__(self, key: Union[pynput.keyboard.Key, pynput.keyboard.KeyCode] = None, press: bool = True, time=0.0):
+        import pynput.keyboard
         if not key:
             name = f"Key {'press' if press else 'release'}"
             key = pynput.keyboard.Key.space
@@ -24,6 +29,7 @@ class KeyCommand(Command):
         self.press = press
 
     def update(self, key: Union[pynput.keyboard.Key, pynput.keyboard.KeyCode] = None, press: bool = None, time: float = None):
+        import pynput.keyboard
         if key:
             self.key = key
             if isinstance(key, pynput.keyboard.KeyCode):
@@ -38,6 +44,11 @@ class KeyCommand(Command):
         key_str = f"{self.keyname} " if self.key else ""
         self.name = f"Key {key_str}{'press' if self.press else 'release'}"
 
+    def copy(self):
+        command = KeyCommand(self.key, self.press, self.time)
+        command.name, command.keyname = self.name, self.keyname
+        return command
+
     def execute(self, keyboard: pynput.keyboard.Controller):
         if self.press:
             keyboard.press(self.key)
@@ -45,6 +56,7 @@ class KeyCommand(Command):
             keyboard.release(self.key)
 
     def __dict__(self):
+        import pynput.keyboard
         if isinstance(self.key, pynput.keyboard.KeyCode):
             k, v = "keycode", self.key.vk
         elif isinstance(self.key, pynput.keyboard.Key):
@@ -1,12 +1,18 @@
-import pynput
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 
 from .mouse_command import MouseCommand
 
+if TYPE_CHECKING:
+    import pynput
+
 
 class MouseClick(MouseCommand):
     def __init__(self, button: pynput.mouse.Button = None, press: bool = True, x: int = 0, y: int = 0, absolute: bool = True,
                  time=0):
         if button is None:
+            import pynput.mouse
             button = pynput.mouse.Button.left
         name = f"Mouse {'press' if press else 'release'} {button}"
         if absolute:
@@ -40,6 +46,11 @@ class MouseClick(MouseCommand):
         else:
             self.name += f" by {self.x}, {self.y}"
 
+    def copy(self):
+        command = MouseClick(self.button, self.press, self.x, self.y, self.absolute, self.time)
+        command.name = self.name
+        return command
+
     def execute(self, mouse: pynput.mouse.Controller):
         if self.absolute:
             mouse.position = (self.x, self.y)
@@ -1,7 +1,12 @@
-import pynput
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 
 from .command import Command
 
+if TYPE_CHECKING:
+    import pynput
+
 
 class MouseCommand(Command):
     def __init__(self, name, time):
@@ -1,7 +1,12 @@
-import pynput
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 
 from .mouse_command import MouseCommand
 
+if TYPE_CHECKING:
+    import pynput
+
 
 class MouseMove(MouseCommand):
     def __init__(self, x: int = 0, y: int = 0, absolute: bool = True, time=0):
@@ -25,6 +30,11 @@ class MouseMove(MouseCommand):
             self.time = time
         self.name = f"Mouse Move to {self.x}, {self.y}" if self.absolute else f"Mouse Move by {self.x}, {self.y}"
 
+    def copy(self):
+        command = MouseMove(self.x, self.y, self.absolute, self.time)
+        command.name = self.name
+        return command
+
     def execute(self, mouse: pynput.mouse.Controller):
         if self.absolute:
             mouse.position = (self.x, self.y)
@@ -1,9 +1,13 @@
-import pynput
+from __future__ import annotations
+
 import time
-from typing import Union
+from typing import TYPE_CHECKING, Union
 
 from .mouse_command import MouseCommand
 
+if TYPE_CHECKING:
+    import pynput
+
 
 class MouseScroll(MouseCommand):
     def __init__(self, x: int = 0, y: int = 0, time=0):
@@ -20,6 +24,11 @@ class MouseScroll(MouseCommand):
             self.time = time
         self.name = f"Mouse Scroll {self.x}, {self.y}"
 
+    def copy(self):
+        command = MouseScroll(self.x, self.y, self.time)
+        command.name = self.name
+        return command
+
     def execute(self, mouse: pynput.mouse.Controller):
         mouse.scroll(self.x, self.y)
 
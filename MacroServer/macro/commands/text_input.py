@@ -1,8 +1,13 @@
+from __future__ import annotations
+
 import time
-import pynput
+from typing import TYPE_CHECKING
 
 from .command import Command
 
+if TYPE_CHECKING:
+    import pynput
+
 
 class TextInput(Command):
     def __init__(self, text: str = "", time=0):
@@ -15,6 +20,12 @@ class TextInput(Command):
         if time:
             self.time = time
         self.name = f"Text input: {self.text}"
+
+    def copy(self):
+        command = TextInput(self.text, self.time)
+        command.name = self.name
+        return command
+
     def execute(self, keyboard: pynput.keyboard.Controller):
         keyboard.type(self.text)
 
@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+import time
+
+REPLACE_ATTEMPTS = 5
+REPLACE_RETRY_DELAY = 0.01  # Doubled after every attempt
+
+
+def write_atomic(path, data):
+    # Written to a temporary file first, after a crash the file is the old or the new one and never a mix of both
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb" if isinstance(data, bytes) else "w") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        replace_file(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def replace_file(source, target):
+    # Windows refuses to replace a file while another process reads it, like the server loading the macro being saved
+    for attempt in range(REPLACE_ATTEMPTS):
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            if sys.platform != "win32" or attempt == REPLACE_ATTEMPTS - 1:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY * 2 ** attempt)
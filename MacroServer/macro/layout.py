@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+
+from .files import write_atomic
+
+
+class LayoutIndex:
+    # Positions of all macros in one file, it overrides the position stored in the macro files
+    FILE_NAME = "layout.index"
+    lock = threading.Lock()
+    cache = {}  # path -> ((mtime, size, inode), positions)
+
+    @staticmethod
+    def file_path(path="macros"):
+        return os.path.join(path, LayoutIndex.FILE_NAME)
+
+    @staticmethod
+    def load(path="macros"):
+        # Returns macro_id -> position, re-read only when the file changes, the dict must not be modified
+        file_path = LayoutIndex.file_path(path)
+        try:
+            stamp = LayoutIndex.stamp(file_path)
+        except FileNotFoundError:
+            return {}
+        with LayoutIndex.lock:
+            cached = LayoutIndex.cache.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        try:
+            with open(file_path, "r") as file:
+                positions = json.loads(file.read())
+        except Exception as e:
+            print(f"Could not read layout index: {e}")
+            return {}
+        with LayoutIndex.lock:
+            LayoutIndex.cache[path] = (stamp, positions)
+        return positions
+
+    @staticmethod
+    def stamp(file_path):
+        # Every save renames a new file into place, the inode tells saves apart within one mtime tick
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    @staticmethod
+    def save(positions, path="macros", replace=False, existing=None):
+        # One write for the whole layout, replace=False keeps the positions of macros that aren't listed
+        # With existing (the ids still there) kept positions of deleted or renamed macros are dropped
+        if replace:
+            positions = dict(positions)
+        else:
+            kept = LayoutIndex.load(path)
+            if existing is not None:
+                kept = {macro_id: position for macro_id, position in kept.items() if macro_id in existing}
+            positions = {**kept, **positions}
+        file_path = LayoutIndex.file_path(path)
+        try:
+            write_atomic(file_path, json.dumps(positions, separators=(",", ":")))
+            # What was written is cached right away instead of trusting the next stat to notice the change
+            with LayoutIndex.lock:
+                LayoutIndex.cache[path] = (LayoutIndex.stamp(file_path), positions)
+        except Exception as e:
+            print(f"Error saving layout: {e}")
+            return False
+        return True
@@ -1,21 +1,43 @@
+from __future__ import annotations
+
 import os
 import threading
 
 from .commands import *
+from .cache import MacroCache
+from . import command_codec
+from .command_codec import CommandList
+from .storage import MacroStore
 
-import pynput.keyboard
-import pynput.mouse
 import time
-import json
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pynput
 
 
 class Macro:
+    # Called with (directory, macro_id) whenever a macro is written or deleted
+    change_listeners = []
+    # Normalized directory -> MacroStore, opened on first use unless set by use_store()
+    stores = {}
+    stores_lock = threading.Lock()
+    # Parsed macros shared by every load in the process, save() and delete() invalidate them
+    parse_cache = MacroCache()
+    # pynput controllers unless replaced by NullController, pynput is imported on the first execution
+    keyboard_controller = None
+    mouse_controller = None
+    # Held modifiers change what every other key and text input produces
+    MODIFIER_KEYS = {"alt", "alt_l", "alt_r", "alt_gr", "cmd", "cmd_l", "cmd_r", "ctrl", "ctrl_l", "ctrl_r",
+                     "shift", "shift_l", "shift_r"}
+
     def __init__(self, name, description, commands: list[Command], repeat, position, timing):
         self.macro_id = ""
         self.name = name
         self.set_name(name)
         self.description = description
-        self.commands = commands.copy()
+        # A CommandList copy decodes its own commands, a list of commands is taken as it is
+        self.commands = commands.copy() if isinstance(commands, CommandList) else list(commands)
         self.repeat = repeat
         self.timing = timing
         self.exit = False
@@ -23,6 +45,9 @@ class Macro:
         self.keys_held_down = set()
         self.btns_held_down = set()
         self.keys_lock = threading.Lock()
+        self.first_event_time = None  # perf_counter() of the first command sent in the last run
+        self.max_drift = 0.0  # Largest delay of a timed command behind its recorded time in the last run
+        self.cache_entry = None  # (key, stamp) of the parse cache entry the commands were loaded from
 
     def release_all_keys(self, keyboard: pynput.keyboard.Controller):
         with self.keys_lock:
@@ -41,33 +66,81 @@ class Macro:
         with self.keys_lock:
             self.keys_held_down.remove(key)
 
-    def execute(self):
-        self.exit = False
+    def copy(self):
+        # Shares the parsed commands, the state of a run is separate
+        return Macro(self.name, self.description, self.commands, self.repeat, self.position, self.timing)
+
+    def execute(self, progress=None):
+        # progress(index, total, elapsed) is called after every command from this thread, it must not block
+        # exit is cleared by whoever creates the run, a stop that came before the thread got here still counts
+        self.first_event_time = None
+        self.max_drift = 0.0
+        if self.exit:
+            return "stopped"
+        # Commands that aren't loaded yet are read from the store while they are played instead of all at once
+        stream = None
         if not self.commands:
-            if not self.load_commands():
+            stream = self.open_command_stream()
+            if stream is not None and not len(stream):
+                stream.close()
                 return "error"
+            if stream is None and not self.load_commands():
+                return "error"
+        commands = stream if stream is not None else self.commands
 
-        keyboard = pynput.keyboard.Controller()
-        mouse = pynput.mouse.Controller()
-        for i in range(self.repeat):
-            start_time = time.perf_counter()
-            for command in self.commands:
-                if self.exit:
-                    break
-                if self.timing:
-                    total_time = time.perf_counter() - start_time
-                    if command.time > total_time:
-                        time.sleep(command.time - total_time)
-
+        if Macro.keyboard_controller is None or Macro.mouse_controller is None:
+            Macro.use_pynput()
+        keyboard = Macro.keyboard_controller()
+        mouse = Macro.mouse_controller()
+        total = self.repeat * len(commands)
+        index = 0
+        run_start = time.perf_counter()
+        try:
+            for i in range(self.repeat):
+                start_time = time.perf_counter()
+                # A loaded CommandList is also played without keeping what it decodes
+                for command in commands.stream() if isinstance(commands, CommandList) else commands:
                     if self.exit:
                         break
+                    if self.timing:
+                        total_time = time.perf_counter() - start_time
+                        if command.time > total_time:
+                            time.sleep(command.time - total_time)
 
-                self.dispatch_command(command, keyboard, mouse)
+                        if self.exit:
+                            break
+                        drift = time.perf_counter() - start_time - command.time
+                        if drift > self.max_drift:
+                            self.max_drift = drift
 
-        self.release_all_keys(keyboard)
-        self.release_all_btns(mouse)
+                    if self.first_event_time is None:
+                        self.first_event_time = time.perf_counter()
+                    self.dispatch_command(command, keyboard, mouse)
+                    index += 1
+                    if progress is not None:
+                        progress(index, total, time.perf_counter() - run_start)
+        finally:
+            if stream is not None:
+                stream.close()
+            self.release_all_keys(keyboard)
+            self.release_all_btns(mouse)
         return "success" if not self.exit else "stopped"
 
+    def open_command_stream(self, path="macros"):
+        try:
+            return Macro.get_store(path).open_commands(self.macro_id)
+        except FileNotFoundError:
+            print(f"Macro not found: {self.macro_id}")
+        except Exception as e:
+            print(f"Could not stream commands of {self.macro_id}: {e}")
+        return None
+
+    @staticmethod
+    def use_pynput():
+        import pynput
+        Macro.keyboard_controller = pynput.keyboard.Controller
+        Macro.mouse_controller = pynput.mouse.Controller
+
     def dispatch_command(self, command, keyboard, mouse):
         if isinstance(command, KeyCommand):
             command.execute(keyboard)
@@ -92,30 +165,80 @@ class Macro:
     def stop(self):
         self.exit = True
 
+    def get_input_resources(self):
+        # Inputs the commands touch, ("keyboard", None) stands for the whole keyboard
+        # Computed once per parse cache entry, scanning a long recording takes a while
+        if self.cache_entry is not None:
+            resources = Macro.parse_cache.get_resources(*self.cache_entry)
+            if resources is not None:
+                return resources
+        resources = self.compute_input_resources()
+        if self.cache_entry is not None:
+            Macro.parse_cache.set_resources(*self.cache_entry, resources)
+        return resources
+
+    def compute_input_resources(self):
+        import pynput.keyboard
+        resources = set()
+        commands = self.commands.distinct() if isinstance(self.commands, CommandList) else self.commands
+        for command in commands:
+            if isinstance(command, KeyCommand):
+                if isinstance(command.key, pynput.keyboard.Key) and command.key.name in Macro.MODIFIER_KEYS:
+                    resources.add(("keyboard", None))
+                else:
+                    resources.add(("key", command.key))
+            elif isinstance(command, TextInput):
+                resources.add(("keyboard", None))
+            elif isinstance(command, MouseClick):
+                resources.add(("button", command.button))
+                resources.add(("pointer", None))
+            elif isinstance(command, MouseMove):
+                resources.add(("pointer", None))
+            elif isinstance(command, MouseScroll):
+                resources.add(("scroll", None))
+        return frozenset(resources)
+
+    @staticmethod
+    def resources_conflict(first, second):
+        if first & second:
+            return True
+        # Text and modifiers conflict with any key
+        if ("keyboard", None) in first:
+            return any(kind == "key" for kind, _ in second)
+        if ("keyboard", None) in second:
+            return any(kind == "key" for kind, _ in first)
+        return False
+
     def save(self, path="macros/", overwrite=False, only_info=False):
         self.set_name(self.name)
         try:
-            if not path.endswith("/"):
-                path += "/"
-            path += f"{self.macro_id}.json"
-            if os.path.exists(path) and not overwrite:
+            store = Macro.get_store(path)
+            if store.exists(self.macro_id) and not overwrite:
                 return
             dct = self.__dict__()
-            commands = {"commands": dct["commands"]}
-            dct.pop("commands")
-            macro_dump = json.dumps(dct)
-            commands_dump = json.dumps(commands)
-            with open(path, "w") as file:
-                file.write(macro_dump)
-            if not only_info:
-                with open(f"{path[:-5]}.commands.json", "w") as file:
-                    file.write(commands_dump)
+            commands = dct.pop("commands")
+            store.write(self.macro_id, dct, None if only_info else commands)
+            Macro.notify_change(store.path, self.macro_id)
+
+        except Exception as e:
+            print(f"Error saving macro: {e}")
 
+    def replace(self, old_macro_id, path="macros"):
+        # Saves the macro in place of another one, a changed name renames it in one step
+        self.set_name(self.name)
+        try:
+            store = Macro.get_store(path)
+            dct = self.__dict__()
+            commands = dct.pop("commands")
+            store.replace(old_macro_id, self.macro_id, dct, commands)
+            if old_macro_id != self.macro_id:
+                Macro.notify_change(store.path, old_macro_id)
+            Macro.notify_change(store.path, self.macro_id)
         except Exception as e:
             print(f"Error saving macro: {e}")
 
     def load_commands(self):
-        macro = Macro.load(f"macros/{self.macro_id}")
+        macro = Macro.load_id(self.macro_id)
         if not macro:
             return False
         self.commands = macro.commands.copy()
@@ -124,55 +247,99 @@ class Macro:
         return True
 
     @staticmethod
-    def load(path):
+    def load(path, count=True):
+        # path is the macro directory joined with the macro id
+        if path.endswith(".json"):
+            path = path[:-5]
+        return Macro.load_id(os.path.basename(path), os.path.dirname(path), count)
+
+    @staticmethod
+    def load_id(macro_id, path="macros", count=True):
+        # Unchanged macros come from the parse cache, count=False keeps warming up out of its hit rate
         try:
-            if not path.endswith(".json"):
-                path += ".json"
-            with open(path, "r") as file:
-                dump_macro = file.read()
-            with open(f"{path[:-5]}.commands.json", "r") as file:
-                dump_commands = file.read()
-            macro_json = json.loads(dump_macro)
-            macro_commands_json = json.loads(dump_commands)
-            commands = []
-            for command in macro_commands_json["commands"]:
-                if command["type"] == "key":
-                    if command["keytype"] == "keycode":
-                        key = pynput.keyboard.KeyCode.from_vk(command["value"])
-                    elif command["keytype"] == "key":
-                        key = getattr(pynput.keyboard.Key, command["value"])
-                    else:
-                        raise ValueError(f"Unknown key type: {command['keytype']}")
-                    # key = pynput.keyboard.KeyCode.from_vk(command["key"])
-                    commands.append(KeyCommand(key, command["press"], command["time"]))
-                elif command["type"] == "delay":
-                    commands.append(Delay(command["delay"], command["time"]))
-                elif command["type"] == "click":
-                    btn_values = command["button"]
-                    # make tuple from btn_values
-                    btn_tuple = (btn_values[0], btn_values[1], btn_values[2])
-                    button = pynput.mouse.Button(btn_tuple)
-                    commands.append(
-                        MouseClick(button, command["press"], command["x"], command["y"], command["absolute"],
-                                   command["time"]))
-                elif command["type"] == "move":
-                    commands.append(MouseMove(command["x"], command["y"], command["absolute"], command["time"]))
-                elif command["type"] == "scroll":
-                    commands.append(MouseScroll(command["x"], command["y"], command["time"]))
-                elif command["type"] == "textinput":
-                    commands.append(TextInput(command["text"], command["time"]))
-                else:
-                    print(f"Unknown command type: {command['type']}")
-            fname = os.path.basename(path)
-            fname = fname.split(".")[0]
+            store = Macro.get_store(path)
+            key = MacroCache.key(path, macro_id)
+            stamp = store.stamp(macro_id)
+            entry = Macro.parse_cache.get(key, stamp, count)
+            if entry is None:
+                macro_json, commands = store.read(macro_id)
+                if not isinstance(commands, CommandList):
+                    commands = Macro.compact_commands(commands)
+                entry = Macro.parse_cache.put(key, stamp, macro_json, commands)
+            macro_json, commands = entry
+            # The cached commands are shared, every macro edits its own Command objects
+            commands = Macro.copy_commands(commands)
+            # The layout isn't part of the stamp, the position is read every time
+            position = store.read_position(macro_id)
             macro = Macro(macro_json["name"], macro_json["description"], commands, macro_json["repeat"],
-                          macro_json["position"], macro_json["timing"])
+                          position if position is not None else macro_json["position"], macro_json["timing"])
+            macro.cache_entry = (key, stamp)
             return macro
 
         except FileNotFoundError:
-            print(f"File not found: {path}")
+            print(f"Macro not found: {os.path.join(path, macro_id)}")
             return None
 
+    @staticmethod
+    def preload(macro_ids, path="macros"):
+        # Parses the macros and finds their input resources in the given order until the parse cache is full
+        for macro_id in macro_ids:
+            if Macro.parse_cache.is_full():
+                break
+            macro = Macro.load_id(macro_id, path, count=False)
+            if macro is not None:
+                macro.get_input_resources()
+
+    @staticmethod
+    def compact_commands(command_dicts):
+        # JSON commands are kept in the binary format too, copies of it decode their commands when they are accessed
+        try:
+            return command_codec.decode(command_codec.encode(command_dicts))
+        except (ValueError, KeyError, TypeError):
+            # Values the records can't hold, the commands stay parsed and are copied for every load
+            return Macro.parse_commands(command_dicts)
+
+    @staticmethod
+    def copy_commands(commands):
+        # Separate Command objects, editing them doesn't change the macro they were copied from
+        if isinstance(commands, CommandList):
+            return commands.copy()
+        return [command.copy() for command in commands]
+
+    @staticmethod
+    def parse_commands(command_dicts):
+        import pynput
+        commands = []
+        for command in command_dicts:
+            if command["type"] == "key":
+                if command["keytype"] == "keycode":
+                    key = pynput.keyboard.KeyCode.from_vk(command["value"])
+                elif command["keytype"] == "key":
+                    key = getattr(pynput.keyboard.Key, command["value"])
+                else:
+                    raise ValueError(f"Unknown key type: {command['keytype']}")
+                # key = pynput.keyboard.KeyCode.from_vk(command["key"])
+                commands.append(KeyCommand(key, command["press"], command["time"]))
+            elif command["type"] == "delay":
+                commands.append(Delay(command["delay"], command["time"]))
+            elif command["type"] == "click":
+                btn_values = command["button"]
+                # make tuple from btn_values
+                btn_tuple = (btn_values[0], btn_values[1], btn_values[2])
+                button = pynput.mouse.Button(btn_tuple)
+                commands.append(
+                    MouseClick(button, command["press"], command["x"], command["y"], command["absolute"],
+                               command["time"]))
+            elif command["type"] == "move":
+                commands.append(MouseMove(command["x"], command["y"], command["absolute"], command["time"]))
+            elif command["type"] == "scroll":
+                commands.append(MouseScroll(command["x"], command["y"], command["time"]))
+            elif command["type"] == "textinput":
+                commands.append(TextInput(command["text"], command["time"]))
+            else:
+                print(f"Unknown command type: {command['type']}")
+        return commands
+
     def set_name(self, name):
         try:
             self.name = name
@@ -199,21 +366,28 @@ class Macro:
         return self.description
 
     @staticmethod
-    def get_all_macros_info():
-        macros_info = []
-        for file in os.listdir("macros"):
-            if file.endswith(".json") and not file.endswith(".commands.json"):
-                try:
-                    with open(f"macros/{file}", "r") as f:
+    def read_info(macro_id, path="macros", positions=None):
+        return Macro.make_info(macro_id, Macro.get_store(path).read_info(macro_id, positions))
+
+    @staticmethod
+    def make_info(macro_id, macro_json):
+        return {"name": macro_json["name"], "description": macro_json["description"],
+                "position": macro_json["position"], "repeat": macro_json["repeat"], "macro_id": macro_id,
+                "timing": macro_json["timing"]}
 
-                        macro_json = json.loads(f.read())
-                        macros_info.append({"name": macro_json["name"], "description": macro_json["description"],
-                                            "position": macro_json["position"], "repeat": macro_json["repeat"],
-                                            "macro_id": file[:-5], "timing": macro_json["timing"]})
-                except Exception as e:
-                    print(f"Could not read file {file}: {e}")
-                    continue
-        return {"macro_list": macros_info}
+    @staticmethod
+    def get_all_macros_info(path="macros"):
+        return {"macro_list": [Macro.make_info(macro_id, info) for macro_id, info in Macro.get_store(path).list_info()]}
+
+    @staticmethod
+    def is_valid_id(macro_id):
+        # Ids made by set_name() never leave the macro directory, ids from clients are checked before use
+        return isinstance(macro_id, str) and macro_id != "" and ".." not in macro_id and not any(
+            char in macro_id for char in ("/", "\\", ":", "\0"))
+
+    @staticmethod
+    def exists(macro_id, path="macros"):
+        return Macro.get_store(path).exists(macro_id)
 
     @staticmethod
     def get_all_macros_info_objects():
@@ -224,15 +398,57 @@ class Macro:
             macros.append(tmp)
         return macros
 
-    def delete(self):
+    def delete(self, path="macros"):
         try:
-            if os.path.exists(f"macros/{self.macro_id}.json"):
-                os.remove(f"macros/{self.macro_id}.json")
-            if os.path.exists(f"macros/{self.macro_id}.commands.json"):
-                os.remove(f"macros/{self.macro_id}.commands.json")
+            store = Macro.get_store(path)
+            store.delete(self.macro_id)
+            Macro.notify_change(store.path, self.macro_id)
         except Exception as e:
             print(f"Error deleting macro: {e}")
 
+    @staticmethod
+    def add_change_listener(listener):
+        Macro.change_listeners.append(listener)
+
+    @staticmethod
+    def remove_change_listener(listener):
+        if listener in Macro.change_listeners:
+            Macro.change_listeners.remove(listener)
+
+    @staticmethod
+    def get_store(path="macros"):
+        key = os.path.normpath(path)
+        with Macro.stores_lock:
+            store = Macro.stores.get(key)
+            if store is None:
+                store = Macro.stores[key] = MacroStore.open(key)
+            return store
+
+    @staticmethod
+    def use_store(store):
+        with Macro.stores_lock:
+            Macro.stores[os.path.normpath(store.path)] = store
+
+    @staticmethod
+    def save_layout(positions, path="macros", replace=False):
+        # Writes all positions at once, the macros themselves keep their old position
+        store = Macro.get_store(path)
+        if store.save_layout(positions, replace):
+            Macro.notify_change(store.path, None)
+
+    @staticmethod
+    def notify_change(path, macro_id, source=None):
+        # macro_id is None when the layout changed, source is a listener that already knows about the change
+        if macro_id is not None:
+            Macro.parse_cache.invalidate(path, macro_id)
+        for listener in Macro.change_listeners:
+            if listener == source:
+                continue
+            try:
+                listener(path, macro_id)
+            except Exception as e:
+                print(f"Error notifying about macro change: {e}")
+
     def __dict__(self):
         return {"name": self.name, "description": self.description, "repeat": self.repeat, "position": self.position,
                 "commands": [c.__dict__() for c in self.commands], "timing": self.timing}
@@ -0,0 +1,20 @@
+class NullController:
+    # Stands in for both pynput controllers when no input should be sent, e.g. in load tests
+    def __init__(self):
+        self.position = (0, 0)
+
+    def press(self, key):
+        pass
+
+    def release(self, key):
+        pass
+
+    def type(self, text):
+        pass
+
+    def move(self, dx, dy):
+        x, y = self.position
+        self.position = (x + dx, y + dy)
+
+    def scroll(self, dx, dy):
+        pass
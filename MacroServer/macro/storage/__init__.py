@@ -0,0 +1,6 @@
+from .macro_store import MacroStore
+from .json_store import JsonMacroStore
+from .sqlite_store import SqliteMacroStore
+from .write_behind_store import WriteBehindStore
+
+__all__ = ["MacroStore", "JsonMacroStore", "SqliteMacroStore", "WriteBehindStore"]
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+import time
+
+from .. import command_codec
+from ..files import write_atomic
+from ..layout import LayoutIndex
+from .macro_store import MacroStore
+
+
+READ_ATTEMPTS = 5
+READ_RETRY_DELAY = 0.005  # Doubles with every attempt, a save takes a few ms with the files synced to disk
+
+
+class JsonMacroStore(MacroStore):
+    # <macro_id>.json with the info and <macro_id>.commands.bin (or .commands.json) with the commands, positions are
+    # in the layout index
+    # Both files of a save have the same generation, the commands are written first and replacing the info file
+    # completes the save, so different generations mean a save was interrupted or is being written
+
+    def __init__(self, path="macros", binary_commands=True):
+        super().__init__(path)
+        self.binary_commands = binary_commands  # False writes the commands as JSON, for export
+
+    def file_path(self, macro_id, kind="", extension="json"):
+        return os.path.join(self.path, f"{macro_id}{kind}.{extension}")
+
+    def commands_path(self, macro_id):
+        # The binary file wins, the JSON one is from before it existed or an export
+        path = self.file_path(macro_id, ".commands", "bin")
+        return path if os.path.exists(path) else self.file_path(macro_id, ".commands")
+
+    def exists(self, macro_id):
+        return os.path.exists(self.file_path(macro_id))
+
+    def macro_ids(self):
+        return {name[:-5] for name in os.listdir(self.path)
+                if name.endswith(".json") and not name.endswith(".commands.json")}
+
+    def stamp(self, macro_id):
+        info = os.stat(self.file_path(macro_id))
+        commands = os.stat(self.commands_path(macro_id))
+        return info.st_mtime_ns, info.st_size, commands.st_mtime_ns, commands.st_size
+
+    def stamps(self):
+        # One scan of the directory, the stamps are the same as stamp() returns
+        files = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith((".json", ".bin")):
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        stamps = {}
+        for name, info in files.items():
+            if not name.endswith(".json") or name.endswith(".commands.json"):
+                continue
+            macro_id = name[:-5]
+            commands = files.get(f"{macro_id}.commands.bin") or files.get(f"{macro_id}.commands.json")
+            if commands is not None:
+                stamps[macro_id] = info + commands
+        return stamps
+
+    def watch_targets(self):
+        return [(self.path, None)]
+
+    def read_info_file(self, macro_id):
+        with open(self.file_path(macro_id), "r") as file:
+            return json.loads(file.read())
+
+    def read_info(self, macro_id, positions=None):
+        info = self.read_info_file(macro_id)
+        info.pop("generation", None)
+        if positions is None:
+            positions = self.load_layout()
+        info["position"] = positions.get(macro_id, info["position"])
+        return info
+
+    def read_commands_file(self, macro_id):
+        # Returns the commands and their generation
+        path = self.commands_path(macro_id)
+        if path.endswith(".bin"):
+            with open(path, "rb") as file:
+                data = file.read()
+            return command_codec.decode(data), command_codec.read_generation(data)
+        with open(path, "r") as file:
+            commands_json = json.loads(file.read())
+        return commands_json["commands"], commands_json.get("generation")
+
+    def read_commands(self, macro_id):
+        return self.read_commands_file(macro_id)[0]
+
+    def read(self, macro_id):
+        # A save between reading the two files is read again once it's complete
+        for attempt in range(READ_ATTEMPTS):
+            if attempt:
+                time.sleep(READ_RETRY_DELAY * 2 ** (attempt - 1))
+            info = self.read_info_file(macro_id)
+            commands, generation = self.read_commands_file(macro_id)
+            if info.get("generation") == generation:
+                break
+        else:
+            print(f"Info and commands of {macro_id} are from different saves, a save was interrupted")
+        info.pop("generation", None)
+        info["position"] = self.load_layout().get(macro_id, info["position"])
+        return info, commands
+
+    def open_commands(self, macro_id):
+        path = self.commands_path(macro_id)
+        if not path.endswith(".bin"):
+            return None
+        # Read at once and closed right away, an open file would make a save replacing it fail on Windows
+        # The records take 24 bytes a command, only decoding them waits until they are played
+        with open(path, "rb") as file:
+            return command_codec.CommandStream(io.BytesIO(file.read()))
+
+    def list_info(self):
+        macros_info = []
+        positions = self.load_layout()
+        for file in os.listdir(self.path):
+            if file.endswith(".json") and not file.endswith(".commands.json"):
+                try:
+                    macros_info.append((file[:-5], self.read_info(file[:-5], positions)))
+                except Exception as e:
+                    print(f"Could not read file {file}: {e}")
+        return macros_info
+
+    def write(self, macro_id, info, commands=None):
+        if commands is None:
+            # The commands stay, so does their generation
+            try:
+                generation = self.read_info_file(macro_id).get("generation")
+            except FileNotFoundError:
+                generation = None
+        else:
+            generation = time.time_ns()
+            binary_path = self.file_path(macro_id, ".commands", "bin")
+            json_path = self.file_path(macro_id, ".commands")
+            data = None
+            if self.binary_commands:
+                try:
+                    data = command_codec.encode(commands, generation)
+                except ValueError as e:
+                    print(f"Saving commands of {macro_id} as JSON: {e}")
+            if data is not None:
+                write_atomic(binary_path, data)
+                stale = json_path
+            else:
+                write_atomic(json_path, json.dumps({"commands": commands, "generation": generation}))
+                stale = binary_path
+            # Before the info, a leftover binary file would be read instead of the new JSON one
+            if os.path.exists(stale):
+                os.remove(stale)
+        write_atomic(self.file_path(macro_id), json.dumps({**info, "generation": generation}))
+
+    def replace(self, old_macro_id, macro_id, info, commands):
+        # Saved first, so a failed write doesn't lose the macro
+        self.write(macro_id, info, commands)
+        if old_macro_id != macro_id:
+            self.delete(old_macro_id)
+
+    def delete(self, macro_id):
+        for path in (self.file_path(macro_id), self.file_path(macro_id, ".commands"),
+                     self.file_path(macro_id, ".commands", "bin")):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_layout(self):
+        return LayoutIndex.load(self.path)
+
+    def save_layout(self, positions, replace=False):
+        try:
+            existing = self.macro_ids()
+        except OSError as e:
+            print(f"Could not list macros, keeping the whole layout: {e}")
+            existing = None
+        return LayoutIndex.save(positions, self.path, replace, existing)
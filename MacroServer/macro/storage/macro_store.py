@@ -0,0 +1,81 @@
+import os
+
+
+class MacroStore:
+    # Info is a dict of name, description, repeat, position and timing, commands are written as the dicts of
+    # Command.__dict__() and read either as such dicts or as a command_codec.CommandList
+    # Missing macros raise FileNotFoundError whatever the backend is
+
+    def __init__(self, path="macros"):
+        self.path = path
+
+    def exists(self, macro_id):
+        raise NotImplementedError
+
+    def stamp(self, macro_id):
+        # Changes whenever the macro is written, parsed macros are valid while it stays the same
+        raise NotImplementedError
+
+    def stamps(self):
+        # Returns macro_id -> stamp of all macros, to find what another process changed
+        raise NotImplementedError
+
+    def watch_targets(self):
+        # Returns [(directory, name prefix or None)], the files whose changes can change the macros
+        raise NotImplementedError
+
+    def read_info(self, macro_id, positions=None):
+        raise NotImplementedError
+
+    def read_commands(self, macro_id):
+        raise NotImplementedError
+
+    def open_commands(self, macro_id):
+        # Returns a command_codec.CommandStream read while the macro plays, None if the commands can't be streamed
+        return None
+
+    def read(self, macro_id):
+        # Returns (info, commands) of the same save
+        return self.read_info(macro_id), self.read_commands(macro_id)
+
+    def read_position(self, macro_id):
+        # The position in the layout, None if the layout doesn't have the macro
+        return self.load_layout().get(macro_id)
+
+    def list_info(self):
+        # Returns [(macro_id, info)] of all macros with the layout positions applied
+        raise NotImplementedError
+
+    def write(self, macro_id, info, commands=None):
+        # commands=None keeps the stored commands
+        raise NotImplementedError
+
+    def replace(self, old_macro_id, macro_id, info, commands):
+        # Writes the macro and removes the old one (renames), the old one stays if the write fails
+        raise NotImplementedError
+
+    def delete(self, macro_id):
+        raise NotImplementedError
+
+    def load_layout(self):
+        # Returns macro_id -> position, the dict must not be modified
+        raise NotImplementedError
+
+    def save_layout(self, positions, replace=False):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def database_path(path="macros"):
+        return os.path.normpath(path) + ".db"
+
+    @staticmethod
+    def open(path="macros"):
+        # The database is used once the directory was migrated to it, see migrate_storage.py
+        from .json_store import JsonMacroStore
+        from .sqlite_store import SqliteMacroStore
+        if os.path.exists(MacroStore.database_path(path)):
+            return SqliteMacroStore(path)
+        return JsonMacroStore(path)
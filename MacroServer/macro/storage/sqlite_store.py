@@ -0,0 +1,174 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .. import command_codec
+from .macro_store import MacroStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS macros (
+    macro_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    repeat INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    timing INTEGER NOT NULL,
+    commands BLOB NOT NULL,
+    updated INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS macros_name ON macros (name);
+CREATE INDEX IF NOT EXISTS macros_position ON macros (position);
+"""
+INFO_COLUMNS = "name, description, repeat, position, timing"
+
+
+class SqliteMacroStore(MacroStore):
+    # All macros in one database next to the directory (macros.db), the position column is the layout and the
+    # commands are stored in the binary commands format
+
+    def __init__(self, path="macros", database=None):
+        super().__init__(path)
+        self.database = database if database is not None else MacroStore.database_path(path)
+        # The server reads from the loop and the macro threads, so one connection is shared under a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.database, timeout=5, check_same_thread=False)
+        with self.lock, self.connection:
+            # WAL lets the manager write while the server reads, with it NORMAL sync is still safe from corruption
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def make_info(row):
+        name, description, repeat, position, timing = row
+        return {"name": name, "description": description, "repeat": repeat, "position": position,
+                "timing": bool(timing)}
+
+    def fetch_one(self, query, macro_id):
+        with self.lock:
+            row = self.connection.execute(query, (macro_id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Macro {macro_id} not found")
+        return row
+
+    def exists(self, macro_id):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM macros WHERE macro_id = ?", (macro_id,)).fetchone()
+        return row is not None
+
+    def stamp(self, macro_id):
+        return self.fetch_one("SELECT updated FROM macros WHERE macro_id = ?", macro_id)[0]
+
+    def stamps(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT macro_id, updated FROM macros").fetchall())
+
+    def watch_targets(self):
+        # Changes land in the write-ahead log first, macros.db-wal
+        return [(os.path.dirname(self.database) or ".", os.path.basename(self.database))]
+
+    def read_info(self, macro_id, positions=None):
+        return self.make_info(self.fetch_one(f"SELECT {INFO_COLUMNS} FROM macros WHERE macro_id = ?", macro_id))
+
+    def read(self, macro_id):
+        # One row, a save can't come between the info and the commands
+        row = self.fetch_one(f"SELECT {INFO_COLUMNS}, commands FROM macros WHERE macro_id = ?", macro_id)
+        return self.make_info(row[:5]), self.decode_commands(row[5])
+
+    def read_position(self, macro_id):
+        return self.fetch_one("SELECT position FROM macros WHERE macro_id = ?", macro_id)[0]
+
+    def read_commands(self, macro_id):
+        # Blobs written before the binary format or with values it can't hold are JSON
+        return self.decode_commands(self.fetch_one("SELECT commands FROM macros WHERE macro_id = ?", macro_id)[0])
+
+    @staticmethod
+    def decode_commands(data):
+        if command_codec.is_binary(data):
+            return command_codec.decode(data)
+        return json.loads(data)
+
+    def open_commands(self, macro_id):
+        rowid, magic = self.fetch_one("SELECT rowid, substr(commands, 1, 4) FROM macros WHERE macro_id = ?", macro_id)
+        if not command_codec.is_binary(magic):
+            return None
+        if not hasattr(sqlite3.Connection, "blobopen"):
+            # Incremental blob reads need Python 3.11, before that the records are read at once
+            return command_codec.CommandStream(io.BytesIO(self.fetch_one(
+                "SELECT commands FROM macros WHERE macro_id = ?", macro_id)[0]))
+        # The stream gets its own connection, the shared one can't be used outside the lock
+        connection = sqlite3.connect(self.database, timeout=5, check_same_thread=False)
+        try:
+            return command_codec.CommandStream(connection.blobopen("macros", "commands", rowid, readonly=True),
+                                               owner=connection)
+        except Exception:
+            connection.close()
+            raise
+
+    @staticmethod
+    def encode_commands(macro_id, commands):
+        try:
+            return command_codec.encode(commands)
+        except ValueError as e:
+            print(f"Saving commands of {macro_id} as JSON: {e}")
+            return json.dumps(commands, separators=(",", ":")).encode()
+
+    def list_info(self):
+        with self.lock:
+            rows = self.connection.execute(f"SELECT macro_id, {INFO_COLUMNS} FROM macros").fetchall()
+        return [(row[0], self.make_info(row[1:])) for row in rows]
+
+    def upsert(self, macro_id, info, commands):
+        # commands=None updates only the info of an existing macro
+        values = (macro_id, info["name"], info["description"], info["repeat"], info["position"], int(info["timing"]),
+                  b"[]" if commands is None else self.encode_commands(macro_id, commands),
+                  time.time_ns())
+        update = "name = excluded.name, description = excluded.description, repeat = excluded.repeat, " \
+                 "position = excluded.position, timing = excluded.timing, updated = excluded.updated"
+        if commands is not None:
+            update += ", commands = excluded.commands"
+        self.connection.execute(f"INSERT INTO macros (macro_id, {INFO_COLUMNS}, commands, updated) "
+                                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (macro_id) DO UPDATE SET {update}",
+                                values)
+
+    def write(self, macro_id, info, commands=None):
+        with self.lock, self.connection:
+            self.upsert(macro_id, info, commands)
+
+    def write_many(self, macros):
+        # [(macro_id, info, commands)] in one transaction, used by the migration
+        with self.lock, self.connection:
+            for macro_id, info, commands in macros:
+                self.upsert(macro_id, info, commands)
+
+    def replace(self, old_macro_id, macro_id, info, commands):
+        with self.lock, self.connection:
+            self.upsert(macro_id, info, commands)
+            if old_macro_id != macro_id:
+                self.connection.execute("DELETE FROM macros WHERE macro_id = ?", (old_macro_id,))
+
+    def delete(self, macro_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM macros WHERE macro_id = ?", (macro_id,))
+
+    def load_layout(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT macro_id, position FROM macros").fetchall())
+
+    def save_layout(self, positions, replace=False):
+        # Macros that aren't listed keep their position, there is no separate layout to replace
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany("UPDATE macros SET position = ? WHERE macro_id = ?",
+                                            [(position, macro_id) for macro_id, position in positions.items()])
+        except sqlite3.Error as e:
+            print(f"Error saving layout: {e}")
+            return False
+        return True
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,242 @@
+import atexit
+import itertools
+import threading
+import time
+
+from .macro_store import MacroStore
+
+RETRY_DELAY = 1.0  # Seconds before a failed write is tried again, doubled after every failure
+MAX_RETRY_DELAY = 60.0
+
+
+class WriteBehindStore(MacroStore):
+    # Writes and layout saves of another store are done by a background thread, repeated saves within delay seconds
+    # of the first one are written once. Reads see the pending changes, renames and deletes are written right away
+    # Whatever is pending is written by close() or when the process exits
+    # A write that fails stays pending and is tried again later, on_error(macro_id, error) is called from the writer
+    # thread for the first failure in a row, macro_id is None for the layout and error is None when save_layout()
+    # returned False
+
+    def __init__(self, store, delay=0.5, on_error=None):
+        super().__init__(store.path)
+        self.store = store
+        self.delay = delay
+        self.pending = {}  # macro_id -> (sequence, due, info, commands)
+        self.layout = None  # (sequence, due, positions, replace)
+        self.failures = {}  # macro_id or None for the layout -> failed writes in a row
+        self.on_error = on_error
+        self.sequences = itertools.count(1)
+        self.condition = threading.Condition()
+        # One flush at a time, a rename or delete waits for the write in progress
+        self.flush_lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed:
+                    due = self.next_due()
+                    now = time.monotonic()
+                    if due is not None and due <= now:
+                        break
+                    self.condition.wait(None if due is None else due - now)
+                if self.closed:
+                    return
+            self.flush(time.monotonic())
+
+    def next_due(self):
+        # Called with the condition held
+        dues = [entry[1] for entry in self.pending.values()]
+        if self.layout is not None:
+            dues.append(self.layout[1])
+        return min(dues, default=None)
+
+    def flush(self, until=None):
+        # Writes what is due by until, everything if it's None
+        with self.flush_lock:
+            with self.condition:
+                layout = self.layout if self.layout is not None and (until is None or self.layout[1] <= until) \
+                    else None
+                # The macros a layout refers to are written before it, a database can't position missing rows
+                macros = [(macro_id, entry) for macro_id, entry in self.pending.items()
+                          if until is None or layout is not None or entry[1] <= until]
+            # An entry stays pending until it's written, so reads never fall back to the old version meanwhile
+            for macro_id, entry in macros:
+                try:
+                    self.store.write(macro_id, entry[2], entry[3])
+                except Exception as e:
+                    self.retry_later(macro_id, entry, e)
+                    continue
+                with self.condition:
+                    if self.pending.get(macro_id) is entry:
+                        del self.pending[macro_id]
+                    self.failures.pop(macro_id, None)
+            if layout is not None:
+                error = None
+                try:
+                    saved = self.store.save_layout(layout[2], layout[3]) is not False
+                except Exception as e:
+                    saved, error = False, e
+                if not saved:
+                    self.retry_later(None, layout, error)
+                    return
+                with self.condition:
+                    if self.layout is layout:
+                        self.layout = None
+                    self.failures.pop(None, None)
+
+    def retry_later(self, macro_id, entry, error):
+        # Keeps the failed entry pending with a later due time, unless a newer save replaced it meanwhile
+        with self.condition:
+            failures = self.failures[macro_id] = self.failures.get(macro_id, 0) + 1
+            delay = min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            retry = entry[:1] + (time.monotonic() + delay,) + entry[2:]
+            if macro_id is None and self.layout is entry:
+                self.layout = retry
+            elif macro_id is not None and self.pending.get(macro_id) is entry:
+                self.pending[macro_id] = retry
+        name = "the layout" if macro_id is None else f"macro {macro_id}"
+        print(f"Error saving {name}, trying again in {delay:g} s: {error if error is not None else 'not saved'}")
+        if self.on_error is not None and failures == 1:
+            try:
+                self.on_error(macro_id, error)
+            except Exception as e:
+                print(f"Error reporting a failed save: {e}")
+
+    def drop(self, *macro_ids):
+        # Forgets pending writes that a rename or delete makes obsolete, called with flush_lock held
+        with self.condition:
+            for macro_id in macro_ids:
+                self.pending.pop(macro_id, None)
+                self.failures.pop(macro_id, None)
+
+    def pending_entry(self, macro_id):
+        with self.condition:
+            return self.pending.get(macro_id)
+
+    def exists(self, macro_id):
+        return self.pending_entry(macro_id) is not None or self.store.exists(macro_id)
+
+    def stamp(self, macro_id):
+        entry = self.pending_entry(macro_id)
+        if entry is not None:
+            return "pending", entry[0]
+        return self.store.stamp(macro_id)
+
+    def stamps(self):
+        stamps = self.store.stamps()
+        with self.condition:
+            for macro_id, entry in self.pending.items():
+                stamps[macro_id] = "pending", entry[0]
+        return stamps
+
+    def watch_targets(self):
+        return self.store.watch_targets()
+
+    def layout_position(self, macro_id):
+        # The position in the pending layout, None if it isn't there
+        with self.condition:
+            layout = self.layout
+        return layout[2].get(macro_id) if layout is not None else None
+
+    def apply_layout(self, macro_id, info):
+        position = self.layout_position(macro_id)
+        if position is not None:
+            info["position"] = position
+        return info
+
+    def read_info(self, macro_id, positions=None):
+        entry = self.pending_entry(macro_id)
+        info = dict(entry[2]) if entry is not None else self.store.read_info(macro_id, positions)
+        return self.apply_layout(macro_id, info)
+
+    def read_commands(self, macro_id):
+        entry = self.pending_entry(macro_id)
+        if entry is not None and entry[3] is not None:
+            return list(entry[3])
+        return self.store.read_commands(macro_id)
+
+    def read(self, macro_id):
+        entry = self.pending_entry(macro_id)
+        if entry is not None:
+            return self.read_info(macro_id), self.read_commands(macro_id)
+        info, commands = self.store.read(macro_id)
+        return self.apply_layout(macro_id, info), commands
+
+    def read_position(self, macro_id):
+        position = self.layout_position(macro_id)
+        if position is not None:
+            return position
+        entry = self.pending_entry(macro_id)
+        return entry[2]["position"] if entry is not None else self.store.read_position(macro_id)
+
+    def open_commands(self, macro_id):
+        entry = self.pending_entry(macro_id)
+        if entry is not None and entry[3] is not None:
+            return None
+        return self.store.open_commands(macro_id)
+
+    def list_info(self):
+        with self.condition:
+            pending = dict(self.pending)
+        macros = dict(self.store.list_info())
+        for macro_id, entry in pending.items():
+            macros[macro_id] = dict(entry[2])
+        return [(macro_id, self.apply_layout(macro_id, info)) for macro_id, info in macros.items()]
+
+    def write(self, macro_id, info, commands=None):
+        with self.condition:
+            if self.closed:
+                self.store.write(macro_id, info, commands)
+                return
+            entry = self.pending.get(macro_id)
+            if commands is None and entry is not None:
+                # Saving only the info keeps the commands of the pending save
+                commands = entry[3]
+            due = entry[1] if entry is not None else time.monotonic() + self.delay
+            self.pending[macro_id] = (next(self.sequences), due, dict(info), commands)
+            self.condition.notify()
+
+    def replace(self, old_macro_id, macro_id, info, commands):
+        with self.flush_lock:
+            self.drop(old_macro_id, macro_id)
+            self.store.replace(old_macro_id, macro_id, info, commands)
+
+    def delete(self, macro_id):
+        with self.flush_lock:
+            self.drop(macro_id)
+            self.store.delete(macro_id)
+
+    def load_layout(self):
+        positions = self.store.load_layout()
+        with self.condition:
+            layout = self.layout
+        if layout is None:
+            return positions
+        return {**positions, **layout[2]}
+
+    def save_layout(self, positions, replace=False):
+        with self.condition:
+            if self.closed:
+                return self.store.save_layout(positions, replace)
+            due = time.monotonic() + self.delay
+            if self.layout is not None:
+                due = self.layout[1]
+                if not replace:
+                    positions = {**self.layout[2], **positions}
+                    replace = self.layout[3]
+            self.layout = (next(self.sequences), due, dict(positions), replace)
+            self.condition.notify()
+        return True
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+        atexit.unregister(self.flush)
+        self.store.close()
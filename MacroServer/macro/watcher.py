@@ -0,0 +1,156 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) event masks and the fixed part of an event: watch descriptor, mask, cookie, name length
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+
+class MacroWatcher:
+    # Calls on_change() from its thread once the watched files stopped changing for debounce seconds, inotify is used
+    # on Linux and the directories are polled every poll_interval seconds elsewhere
+    # targets are [(directory, name prefix or None)] as MacroStore.watch_targets() returns them
+
+    def __init__(self, targets, on_change, debounce=0.2, poll_interval=1.0, max_delay=2.0):
+        self.targets = targets
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.max_delay = max_delay  # A directory that never stops changing is still reported this often
+        self.stopped = threading.Event()
+        self.thread = None
+        self.inotify = None
+        self.libc = None
+        self.watches = {}  # Watch descriptor -> target
+        self.snapshot = None
+
+    def start(self):
+        self.inotify = self.open_inotify()
+        if self.inotify is None:
+            self.snapshot = self.scan()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.inotify is not None:
+            os.close(self.inotify)
+            self.inotify = None
+
+    def mode(self):
+        return "inotify" if self.inotify is not None else "poll"
+
+    def open_inotify(self):
+        # Returns the inotify descriptor watching all targets, None where inotify isn't available
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available, polling for changes: {e}")
+            return None
+        if fd < 0:
+            print(f"inotify is not available, polling for changes: {os.strerror(ctypes.get_errno())}")
+            return None
+        for target in self.targets:
+            wd = self.libc.inotify_add_watch(fd, os.fsencode(target[0]), WATCH_MASK)
+            if wd < 0:
+                print(f"Cannot watch {target[0]}, polling for changes: {os.strerror(ctypes.get_errno())}")
+                os.close(fd)
+                return None
+            self.watches[wd] = target
+        return fd
+
+    @staticmethod
+    def matches(target, name):
+        # Temporary files of atomic writes are followed by the rename that matters
+        if name.endswith(".tmp"):
+            return False
+        return target[1] is None or name.startswith(target[1])
+
+    def read_events(self, timeout):
+        # Returns True if a watched file changed within the timeout
+        readable, _, _ = select.select([self.inotify], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            data = os.read(self.inotify, 64 * 1024)
+        except BlockingIOError:
+            return False
+        changed = False
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0").decode(errors="replace")
+            offset += EVENT.size + length
+            target = self.watches.get(wd)
+            # wd is -1 when the queue overflowed and events were lost
+            if wd == -1 or target is not None and self.matches(target, name):
+                changed = True
+        return changed
+
+    def scan(self):
+        # (mtime, size) of every watched file, compared between polls
+        snapshot = {}
+        for target in self.targets:
+            try:
+                with os.scandir(target[0]) as entries:
+                    for entry in entries:
+                        if self.matches(target, entry.name):
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                pass
+        return snapshot
+
+    def poll(self, timeout):
+        if self.stopped.wait(min(timeout, self.poll_interval)):
+            return False
+        snapshot = self.scan()
+        changed = snapshot != self.snapshot
+        self.snapshot = snapshot
+        return changed
+
+    def run(self):
+        first_change = None  # When the changes waiting for the debounce started
+        last_change = None
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            if last_change is None:
+                # inotify wakes up to check stop(), polling is what costs
+                timeout = 0.5 if self.inotify is not None else self.poll_interval
+            else:
+                timeout = max(0.0, last_change + self.debounce - now)
+            try:
+                changed = self.read_events(timeout) if self.inotify is not None else self.poll(timeout)
+            except Exception as e:
+                print(f"Error watching macros: {e}")
+                changed = False
+                self.stopped.wait(self.poll_interval)
+            now = time.monotonic()
+            if changed:
+                last_change = now
+                if first_change is None:
+                    first_change = now
+            if last_change is not None and (now - last_change >= self.debounce or
+                                            now - first_change >= self.max_delay):
+                first_change = last_change = None
+                try:
+                    self.on_change()
+                except Exception as e:
+                    print(f"Error handling macro changes: {e}")
@@ -2,18 +2,22 @@ import sys
 from threading import Thread
 
 from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, QScrollArea, QVBoxLayout, QLabel, \
-    QHBoxLayout, QPushButton, QSizePolicy, QSpacerItem
+    QHBoxLayout, QPushButton, QSizePolicy, QSpacerItem, QMessageBox
 from PyQt6.QtGui import QColor, QPalette
-from PyQt6.QtCore import Qt, QRect
+from PyQt6.QtCore import Qt, QRect, pyqtSignal
 
 from app_qt import MacroSquare
 from app_qt import MacroEditor
-from macro import Macro
+from macro import Macro, WriteBehindStore
 
 
 class MainWindow(QMainWindow):
+    # Emitted from the thread that writes saves in the background, shown on the UI thread
+    save_failed = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
+        self.save_failed.connect(self.show_save_error)
         self.macros = []
         self.editors = {}
         self.base_central_widget = None
@@ -193,9 +197,11 @@ class MainWindow(QMainWindow):
         if save:
             for macro in self.macros_to_delete:
                 macro.delete()
+            positions = {}
             for i, ms in enumerate(self.macros):
                 ms.macro.position = i
-                ms.macro.save("macros", overwrite=True, only_info=True)
+                positions[ms.macro.macro_id] = i
+            Macro.save_layout(positions, "macros", replace=True)
         else:
             self.macros.sort(key=lambda x: x.macro.position)
             self.load_macros()
@@ -254,8 +260,7 @@ class MainWindow(QMainWindow):
                     else:
                         is_unique = True
 
-            editor.orig_macro.delete()
-            editor.macro.save(overwrite=True)
+            editor.macro.replace(editor.orig_macro.macro_id)
 
             self.load_macros()
             self.refill_grid()
@@ -328,8 +333,19 @@ class MainWindow(QMainWindow):
     def refresh_layout(self):  # btn click
         self.__update_layout()
 
+    def report_save_error(self, macro_id, error):
+        what = "the layout" if macro_id is None else f"macro {macro_id}"
+        reason = f": {error}" if error is not None else ""
+        self.save_failed.emit(f"Could not save {what}{reason}\nIt will be tried again, the change is kept until then.")
+
+    def show_save_error(self, message):
+        QMessageBox.warning(self, "Saving failed", message)
+
 
 if __name__ == "__main__":
+    # Saves and layout edits are written in the background instead of on the UI thread
+    store = WriteBehindStore(Macro.get_store("macros"))
+    Macro.use_store(store)
     app = QApplication(sys.argv)
     with open("app_qt/css/style.css", "r") as f:
         app.setStyleSheet(f.read())
@@ -352,7 +368,9 @@ if __name__ == "__main__":
 
     app.setPalette(palette)
     window = MainWindow()
+    store.on_error = window.report_save_error
     window.setPalette(palette)
     window.show()
     app_exec_val = app.exec()
+    Macro.get_store("macros").close()
     sys.exit(app_exec_val)
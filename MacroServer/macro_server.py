@@ -1,3 +1,5 @@
+import asyncio
+import itertools
 import ctypes
 import socket
 import selectors
@@ -8,37 +10,139 @@ import json
 import click
 import sys
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Dict
 
-from macro import Macro
+from macro import JsonMacroStore, Macro, MacroCatalog, MacroWatcher, NullController, SqliteMacroStore, WriteBehindStore
+from server import ApprovalQueue, BanList, ExecutionQueue, FrameBuffer, FrameTooLarge, HeartbeatScheduler, Metrics, \
+    TokenBucket, codec
+
+# Messages that can be thrown away when a client can't keep up, a newer one always follows
+DROPPABLE_MESSAGES = {'heartbeat', 'macro-progress'}
+MAX_BATCH_OPERATIONS = 64
+# Rate limit class of the messages that cost the server something, the rest only counts for the flood detection
+MESSAGE_CLASSES = {'request-macros': 'catalog', 'request-macros-update': 'catalog', 'execute-macro': 'execute',
+                   'stop-macro': 'execute', 'set-layout': 'layout', 'request-stats': 'stats'}
+# Messages per second and burst allowed to a client in each class
+RATE_LIMITS = {'catalog': (2.0, 10), 'execute': (20.0, 40), 'layout': (1.0, 5), 'stats': (1.0, 5)}
+
+# Heartbeats are answered with pre-encoded messages, the ping is recognized without parsing JSON
+HEARTBEAT_PONG = json.dumps({'type': 'heartbeat', 'data': 'pong'}).encode() + b'\n'
+HEARTBEAT_PINGS = {json.dumps({'type': 'heartbeat', 'data': 'ping'}, separators=separators).encode()
+                   for separators in ((',', ':'), (', ', ': '))}
+
+
+@dataclass
+class ServerOptions:
+    max_queue_size: int = 1024 * 1024
+    slow_client_policy: str = 'drop'  # 'drop' or 'disconnect'
+    auth_timeout: float = 30.0
+    max_frame_size: int = 1024 * 1024
+    compression_threshold: int = 1024  # Smaller frames are never compressed
+    heartbeat_timeout: float = 15.0
+    heartbeat_interval: float = 5.0  # Sent to clients in the hello reply
+    max_queued_per_client: int = 8
+    coalesce_window: float = 0.3  # Repeated execute-macro for the same macro within this time is ignored
+    macro_cache_size: int = 64 * 2 ** 20  # Bytes of parsed macros kept in memory, 0 disables the cache
+    stats_file: str = None  # Metrics are written here every stats_interval seconds if set
+    stats_interval: float = 60.0
+    progress_rate: float = 5.0  # macro-progress messages per second and client, 0 disables them
+    rate_limits: dict = field(default_factory=lambda: dict(RATE_LIMITS))  # class -> (rate, burst), see MESSAGE_CLASSES
+    max_buffered: int = 2 * 1024 * 1024  # Received bytes per client waiting to be processed
+    flood_rate: float = 100.0  # Messages of any type per second, a client sending more is banned, 0 disables it
+    ban_duration: float = 300.0
+    watch_interval: float = 1.0  # Seconds between polls of the macros where inotify isn't available, 0 disables watching
+    watch_debounce: float = 0.2  # Changes are handled once the files stopped changing for this long
+
+
+@dataclass
+class MacroJob:
+    job_id: int
+    macro: Macro
+    resources: frozenset
+    requested_at: float = 0.0  # perf_counter() when the execute-macro arrived
+    started_at: float = 0.0  # perf_counter() when its thread was started, after waiting in the queue
+    progress: tuple = None  # Latest (index, total, elapsed) reported by the macro thread
+    progress_pending: bool = False
+    next_progress: float = 0.0
+    stopping: bool = False  # Stopped but its thread still runs, it holds its resources until macro_finished()
+
+    def __post_init__(self):
+        # A stop is only meant for this job from here on, see Macro.execute()
+        self.macro.exit = False
 
 
 class SocketClient:
-    def __init__(self, sock, addr, port):
+    def __init__(self, sock, addr, port, max_frame_size=1024 * 1024):
         self.sock = sock
         self.addr = addr
         self.port = port
         self.authorized = False
-        self.buffer = b''
+        self.buffer = FrameBuffer(max_frame_size)
+        self.framing = 'json'  # 'json' - newline delimited JSON, 'binary' - length prefixed binary frames
+        self.compression = None  # Compression method of binary frames, negotiated in hello
         self.last_heartbeat = time.time()
+        self.outbound = deque()
+        self.outbound_bytes = 0
+        self.outbound_offset = 0
+        self.outbound_lock = threading.Lock()
+        self.want_write = False
+        self.closing = False
+        self.catalog_version = None  # Last catalog version sent to a client that asked for deltas
+        self.job_events = False  # Macro events carry {macro_id, job_id} instead of just the macro id
+        self.progress_bucket = None
+        self.rate_buckets: dict[str, TokenBucket] = {}
+        self.flood_bucket = None
+        self.batch_replies = None  # Collects the replies while a batch is being handled
+
+    @property
+    def queue_depth(self):
+        return self.outbound_bytes
 
 
 class Server:
-    def __init__(self):
+    def __init__(self, options: ServerOptions = None):
+        self.options = options if options is not None else ServerOptions()
         self.sel = None
         self.refs = []
         self.accept_sock = None
         self.clients: Dict[SocketClient] = {}
-        self.forbidden_clients: [str] = []
-        self.heartbeat_thread = None
+        self.forbidden_clients = BanList()
+        self.heartbeats = HeartbeatScheduler(self.options.heartbeat_timeout)
         self.auth_mode = False
-        self.macro_running = None
+        self.approvals = None
+        self.metrics = Metrics()
+        self.catalog = MacroCatalog(on_load=lambda seconds: self.metrics.observe('catalog.build', seconds))
+        Macro.parse_cache.resize(self.options.macro_cache_size)
+        self.watcher = None
+        self.jobs: Dict[int, MacroJob] = {}
+        self.jobs_lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.queue = ExecutionQueue(self.options.max_queued_per_client, self.options.coalesce_window)
+        self.handlers = {}
+        self.register_handler('hello', self.negotiate)
+        self.register_handler('heartbeat', self.handle_heartbeat)
+        self.register_handler('request-macros', self.handle_request_macros)
+        self.register_handler('request-macros-update', self.handle_request_macros_update)
+        self.register_handler('execute-macro', self.handle_execute_macro)
+        self.register_handler('stop-macro', self.handle_stop_macro)
+        self.register_handler('set-layout', self.handle_set_layout)
+        self.register_handler('batch', self.handle_batch)
+        self.register_handler('request-stats', self.handle_request_stats)
+        self.loop_thread = None
+        self.waker = None
+        self.wakeup_sock = None
+        self.callbacks = deque()
 
     def run(self, server_addr, port, max_attempts, auth_mode):
 
         self.auth_mode = auth_mode
-        self.heartbeat_thread = threading.Thread(target=self.heartbeat_monitor, daemon=True)
-        self.heartbeat_thread.start()
+        if auth_mode:
+            self.approvals = ApprovalQueue(lambda pending, decision: self.call_soon_threadsafe(
+                self.on_approval, pending, decision), self.options.auth_timeout)
+            self.approvals.start()
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.accept_sock:
             for i in range(max_attempts):
                 try_port = port + i
@@ -57,30 +161,79 @@ class Server:
             self.accept_sock.setblocking(False)
             self.sel.register(self.accept_sock, selectors.EVENT_READ, data=(self.accept, None))
 
+            # Other threads hand work to the loop through call_soon_threadsafe and wake it up with the socket pair
+            self.loop_thread = threading.get_ident()
+            self.wakeup_sock, self.waker = socket.socketpair()
+            self.wakeup_sock.setblocking(False)
+            self.waker.setblocking(False)
+            self.sel.register(self.wakeup_sock, selectors.EVENT_READ, data=(self.handle_wakeup, None))
+
             print(f'Server listening on {server_addr}:{try_port}.')
+            self.start_warm_up()
+            self.start_stats_dump()
+            self.start_watcher()
             try:
                 while True:
-                    events = self.sel.select(timeout=1)
+                    events = self.sel.select(timeout=self.select_timeout())
                     for key, mask in events:
                         callback = key.data[0]
                         callback(key.fileobj, mask, key.data[1])
+                    self.expire_heartbeats()
+                    if self.approvals is not None:
+                        for pending in self.approvals.pop_expired():
+                            self.finish_approval(pending, 'timeout')
             except Exception as e:
                 print(f"Error: {e}")
             finally:
                 self.end()
 
-    def heartbeat_monitor(self):
-        while True:
-            now = time.time()
-            to_remove = []
-            for addr, client in self.clients.items():
-                if now - client.last_heartbeat > 15:
-                    print(f"Client {addr} timed out.")
-                    self.disconnect_client(client)
-                    to_remove.append(addr)
-            for addr in to_remove:
-                self.clients.pop(addr)
-            time.sleep(1)
+    def select_timeout(self):
+        # Sleep until the nearest deadline, other threads wake the loop up through call_soon_threadsafe
+        deadlines = [self.heartbeats.next_deadline()]
+        if self.approvals is not None:
+            deadlines.append(self.approvals.next_deadline())
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def expire_heartbeats(self):
+        for addr in self.heartbeats.pop_expired():
+            client = self.clients.get(addr)
+            if client is not None:
+                print(f"Client {addr} timed out.")
+                self.metrics.count('connections.timed_out')
+                self.disconnect_client(client)
+
+    def answer_heartbeat(self, client, cheap=False):
+        self.heartbeats.touch((client.addr, client.port))
+        self.metrics.count('heartbeats')
+        client.last_heartbeat = time.time()
+        if client.batch_replies is not None:
+            self.send_message(client, 'heartbeat', 'pong')
+            return
+        if client.framing == 'binary':
+            data = codec.HEARTBEAT_FRAME if cheap else self.encode_for(client, 'heartbeat', 'pong')
+        else:
+            data = HEARTBEAT_PONG
+        self.write(client, data, droppable=True)
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.callbacks.append((callback, args))
+        try:
+            self.waker.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Loop is already being woken up or is closed
+
+    def handle_wakeup(self, sock, mask, *args, **kwargs):
+        try:
+            while sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.callbacks:
+            callback, args = self.callbacks.popleft()
+            callback(*args)
 
     def disconnect_client(self, client):
         try:
@@ -90,43 +243,66 @@ class Server:
             if client.sock and client.sock.fileno() != -1:
                 self.sel.unregister(client.sock)
                 client.sock.close()
-            self.clients.pop(client.addr)
+            client.sock = None
+            self.heartbeats.remove((client.addr, client.port))
+            self.remove_queued(client)
+            with client.outbound_lock:
+                client.outbound.clear()
+                client.outbound_bytes = 0
+                client.outbound_offset = 0
+            if self.clients.pop((client.addr, client.port), None) is not None:
+                self.metrics.count('connections.closed')
         except Exception as e:
             print(f"Error closing client socket: {e}")
 
     def accept(self, sock, mask, *args, **kwargs):
         conn, addr = sock.accept()
         print(f'Client connected: {addr[0]}:{addr[1]}')
+        self.metrics.count('connections.opened')
         if addr[0] in self.forbidden_clients:
             print(f'Forbidden client {addr} tried to connect, disconnecting them.')
-            self.send_message(conn, 'hello', 'reject')
-            conn.close()
+            self.reject_connection(conn)
             return
 
         if self.auth_mode:
-            approve = input(
-                f"Approve connection from {addr[0]}:{addr[1]}? Yes / No / Ban (y/n/b): ")
-            if approve.lower() == 'y' or approve.lower() == 'yes':
-                pass
-            elif approve.lower() == 'b' or approve.lower() == 'ban':
-                self.forbidden_clients.append(addr[0])
-                self.send_message(conn, 'hello', 'reject')
-                conn.close()
-                return
-            else:
-                self.send_message(conn, 'hello', 'reject')
-                conn.close()
-                return
+            self.approvals.submit(conn, addr)
+            return
 
-        self.clients[addr] = SocketClient(conn, addr[0], addr[1])
+        self.accept_connection(conn, addr)
+
+    def accept_connection(self, conn, addr):
+        self.clients[addr] = SocketClient(conn, addr[0], addr[1], self.options.max_frame_size)
         self.clients[addr].authorized = True
 
         conn.setblocking(False)
-        self.send_message(conn, 'hello', 'accept')
         self.sel.register(conn, selectors.EVENT_READ, data=(self.handle_socket_message, addr))
+        self.heartbeats.touch(addr)
+        self.send_message(self.clients[addr], 'hello', 'accept')
+
+    def reject_connection(self, conn):
+        try:
+            conn.sendall(self.encode_message('hello', 'reject'))
+            conn.close()
+        except OSError as e:
+            print(f"Error rejecting connection: {e}")
+
+    def on_approval(self, pending, decision):
+        if self.approvals.resolve(pending):
+            self.finish_approval(pending, decision)
+
+    def finish_approval(self, pending, decision):
+        addr = pending.addr
+        if decision == 'accept':
+            self.accept_connection(pending.connection, addr)
+            return
+        if decision == 'ban':
+            self.forbidden_clients.ban(addr[0])
+        elif decision == 'timeout':
+            print(f'Connection from {addr[0]}:{addr[1]} was not approved in time, rejecting it.')
+        self.reject_connection(pending.connection)
 
     def handle_socket_message(self, sock, mask, addr):
-        client = self.clients[addr]
+        client = self.clients.get(addr)
         if addr[0] in self.forbidden_clients:
             print(f'Attempt to send message from forbidden client {addr}.')
             self.disconnect_client(client)
@@ -141,17 +317,12 @@ class Server:
             return
 
         try:
+            if mask & selectors.EVENT_WRITE:
+                self.flush(client)
             if mask & selectors.EVENT_READ:
-                data = sock.recv(4096)
-                if not data:
+                if not client.buffer.recv_into(sock):
                     raise OSError
-                client.buffer += data
-                while b'\n' in client.buffer:
-                    message, client.buffer = client.buffer.split(b'\n', 1)
-                    msg_dict = json.loads(message)
-                    self.handle_message(msg_dict, client)
-            else:
-                print(f'Unexpected mask: {mask}')
+                self.process_buffer(client)
 
             return
 
@@ -162,120 +333,825 @@ class Server:
             print(f"Error retrieving message: {e}")
 
         if addr in self.clients:
-            self.sel.unregister(sock)
-            sock.close()
-            self.clients[addr].sock = None
-            self.clients.pop(addr)
+            self.disconnect_client(client)
 
-    def send_message(self, sock, msg_type, msg_data):
+    def process_buffer(self, client):
+        # The framing can change after any message (hello), so it's checked before reading each one
+        if len(client.buffer) > self.options.max_buffered:
+            raise FrameTooLarge(f'{len(client.buffer)} bytes received and not processed')
+        while client.sock is not None and not client.closing:
+            if client.framing == 'binary':
+                frame = client.buffer.next_frame()
+                if frame is None or not self.check_flood(client):
+                    break
+                flags, payload = frame
+                if flags & codec.FLAG_HEARTBEAT:
+                    self.answer_heartbeat(client, cheap=True)
+                    continue
+                if flags & codec.FLAG_COMPRESSED:
+                    if client.compression is None:
+                        raise ValueError('Compressed frame without negotiated compression')
+                    payload = codec.decompress(payload, client.compression, self.options.max_frame_size)
+                msg_dict = codec.decode(payload)
+            else:
+                line = client.buffer.next_line()
+                if line is None or not self.check_flood(client):
+                    break
+                if line in HEARTBEAT_PINGS:
+                    self.answer_heartbeat(client)
+                    continue
+                msg_dict = json.loads(line)
+            self.handle_message(msg_dict, client)
+
+    def encode_message(self, msg_type, msg_data, framing='json', compression=None):
         message = {'type': msg_type, 'data': msg_data}
-        enc_message = json.dumps(message).encode() + b'\n'
-        sock.sendall(enc_message)
+        if framing == 'binary':
+            payload = codec.encode(message)
+            if compression is not None and len(payload) >= self.options.compression_threshold:
+                compressed = codec.compress(payload, compression)
+                if len(compressed) < len(payload):
+                    return codec.encode_frame(compressed, codec.FLAG_COMPRESSED)
+            return codec.encode_frame(payload)
+        return json.dumps(message).encode() + b'\n'
+
+    def encode_for(self, client, msg_type, msg_data):
+        return self.encode_message(msg_type, msg_data, client.framing, client.compression)
+
+    def write(self, client, data, droppable=False):
+        with client.outbound_lock:
+            if client.sock is None or client.closing:
+                return
+            if client.outbound_bytes + len(data) > self.options.max_queue_size:
+                if not self.make_room(client, len(data), droppable):
+                    return
+            client.outbound.append((data, droppable))
+            client.outbound_bytes += len(data)
+
+        if threading.get_ident() == self.loop_thread:
+            self.flush(client)
+        else:
+            self.call_soon_threadsafe(self.flush, client)
+
+    def make_room(self, client, size, droppable):
+        # Called with client.outbound_lock held, returns whether the new frame should be queued
+        if self.options.slow_client_policy == 'drop':
+            kept = deque()
+            for i, (data, frame_droppable) in enumerate(client.outbound):
+                if frame_droppable and not (i == 0 and client.outbound_offset):
+                    client.outbound_bytes -= len(data)
+                else:
+                    kept.append((data, frame_droppable))
+            client.outbound = kept
+            if client.outbound_bytes + size <= self.options.max_queue_size:
+                return True
+            if droppable:
+                return False
+
+        print(f'Client {client.addr}:{client.port} is too slow ({client.outbound_bytes} bytes queued), disconnecting.')
+        self.metrics.count('connections.too_slow')
+        client.closing = True
+        self.call_soon_threadsafe(self.disconnect_client, client)
+        return False
 
-    def send_message_to_all(self, msg_type, msg_data, not_to=None):
-        for addr, client in self.clients.items():
-            if not_to is not None and client == not_to:
+    def flush(self, client):
+        sock = client.sock
+        if sock is None:
+            return
+        with client.outbound_lock:
+            try:
+                while client.outbound:
+                    data, _ = client.outbound[0]
+                    sent = sock.send(memoryview(data)[client.outbound_offset:])
+                    client.outbound_offset += sent
+                    if client.outbound_offset < len(data):
+                        break
+                    client.outbound.popleft()
+                    client.outbound_bytes -= len(data)
+                    client.outbound_offset = 0
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                print(f"Error sending to client {client.addr}:{client.port}: {e}")
+                client.closing = True
+                client.outbound.clear()
+                client.outbound_bytes = 0
+                client.outbound_offset = 0
+                self.call_soon_threadsafe(self.disconnect_client, client)
+                return
+            want_write = bool(client.outbound)
+
+        if want_write != client.want_write:
+            client.want_write = want_write
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if want_write else selectors.EVENT_READ
+            self.sel.modify(sock, events, data=(self.handle_socket_message, (client.addr, client.port)))
+
+    def send_message(self, client, msg_type, msg_data):
+        if client.batch_replies is not None:
+            client.batch_replies.append({'type': msg_type, 'data': msg_data})
+            return
+        self.write(client, self.encode_for(client, msg_type, msg_data), msg_type in DROPPABLE_MESSAGES)
+
+    def send_message_to_all(self, msg_type, msg_data, not_to=None, clients=None):
+        # The message is encoded once for each framing and compression in use, the clients queue the same bytes
+        encoded = {}
+        for client in list(self.clients.values()) if clients is None else clients:
+            if client is not_to or not client.sock:
+                continue
+            if client.batch_replies is not None:
+                self.send_message(client, msg_type, msg_data)
                 continue
-            if client.sock:
-                self.send_message(client.sock, msg_type, msg_data)
+            key = (client.framing, client.compression)
+            data = encoded.get(key)
+            if data is None:
+                data = encoded[key] = self.encode_for(client, msg_type, msg_data)
+            self.write(client, data, msg_type in DROPPABLE_MESSAGES)
+
+    def register_handler(self, message_type, handler):
+        # handler(client, message_data) is called for every message of the type, replaces the previous handler
+        self.handlers[message_type] = handler
 
     def handle_message(self, message_dict, client):
         if client is None:
             raise ValueError('Client is None in handle message')
         message_type = message_dict.get('type')
         message_data = message_dict.get('data')
-        if message_type == 'heartbeat':
-            self.send_message(client.sock, 'heartbeat', 'pong')
-            client.last_heartbeat = time.time()
-        if message_type == 'request-macros':
-            self.send_message(client.sock, 'macro-list', self.get_macros())
-        if message_type == 'request-macros-update':
-            self.send_message(client.sock, 'update-macro-list', self.get_macros())
-        if message_type == 'execute-macro':
-            if self.macro_running is not None:
-                self.send_message(client.sock, 'macro-already-running', self.macro_running.macro_id)
-                return
-            macro = self.get_macro(message_data)
-            if macro is None:
-                self.send_message(client.sock, 'error', f'Macro {message_data} not found')
-                return
-            self.macro_running = macro
+        handler = self.handlers.get(message_type)
+        if handler is None:
+            print(f'Unknown message type {message_type} from {client.addr}:{client.port}.')
+            self.metrics.count('messages.unknown')
+            if client.batch_replies is not None:
+                # Every operation of a batch gets a reply, the client matches them by position
+                self.send_message(client, 'error', f'Unknown message type {message_type}')
+            return
+        if not self.allow_message(client, message_type):
+            self.metrics.count('messages.rate_limited')
+            self.send_message(client, 'rate-limited', message_type)
+            return
+        start = time.perf_counter()
+        handler(client, message_data)
+        self.metrics.observe(f'message.{message_type}', time.perf_counter() - start)
+
+    def allow_message(self, client, message_type):
+        limit_class = MESSAGE_CLASSES.get(message_type)
+        limit = self.options.rate_limits.get(limit_class)
+        if limit is None or limit[0] <= 0:
+            return True
+        bucket = client.rate_buckets.get(limit_class)
+        if bucket is None:
+            bucket = client.rate_buckets[limit_class] = TokenBucket(*limit)
+        return bucket.take()
+
+    def check_flood(self, client):
+        # Every received message takes a token, heartbeats included, a client that runs out is banned for a while
+        if self.options.flood_rate <= 0:
+            return True
+        if client.flood_bucket is None:
+            client.flood_bucket = TokenBucket(self.options.flood_rate, self.options.flood_rate * 2)
+        if client.flood_bucket.take():
+            return True
+        print(f'Client {client.addr}:{client.port} is flooding the server, banned for {self.options.ban_duration:g} s.')
+        self.metrics.count('connections.banned')
+        self.forbidden_clients.ban(client.addr, self.options.ban_duration)
+        client.closing = True
+        self.call_soon_threadsafe(self.disconnect_client, client)
+        return False
+
+    def handle_heartbeat(self, client, message_data):
+        self.answer_heartbeat(client)
 
-            t = threading.Thread(target=self.execute_macro, daemon=False)
-            t.start()
-            self.send_message_to_all('macro-started', message_data)
+    def handle_request_macros(self, client, message_data):
+        self.send_catalog_update(client, 'macro-list', message_data)
 
-        if message_type == 'stop-macro':
-            if self.macro_running is not None:
-                self.macro_running.stop()
-                self.send_message_to_all('macro-stopped', self.macro_running.macro_id)
-                self.macro_running = None
+    def handle_request_macros_update(self, client, message_data):
+        self.send_catalog_update(client, 'update-macro-list', message_data)
+
+    def handle_execute_macro(self, client, message_data):
+        # Data is the macro id or {macro_id, priority}, higher priorities leave the queue first
+        requested_at = time.perf_counter()
+        priority = 0
+        if isinstance(message_data, dict):
+            priority = message_data.get('priority', 0)
+            message_data = message_data.get('macro_id')
+            if not isinstance(priority, int):
+                self.send_message(client, 'error', 'Invalid priority')
                 return
-            self.send_message(client.sock, 'error', 'No macro running')
-        if message_type == 'set-layout':
-            macro_list = []
-            try:
-                layout = json.loads(message_data)
-                for macro in layout:
-                    macro_id = macro.get('macro_id')
-                    position = macro.get('position')
-                    if macro_id is not None and position is not None:
-                        m = Macro.load(f'macros/{macro_id}.json')
-                        if not m:
-                            self.send_message(client.sock, 'error', f'Macro {macro_id} not found')
-                            continue
-                        m.position = position
-                        macro_list.append(m)
-                    else:
-                        self.send_message(client.sock, 'error', 'Invalid layout data')
+        macro = self.get_macro(message_data)
+        if macro is None:
+            self.send_message(client, 'error', f'Macro {message_data} not found')
+            return
+        resources = macro.get_input_resources()
+        job = queued = running = None
+        with self.jobs_lock:
+            if self.queue.coalesce(macro.macro_id):
+                # A double tap, answer with the request it duplicates if that one didn't finish yet
+                queued = self.queue.find(macro.macro_id)
+                running = next((other for other in self.jobs.values()
+                                if other.macro.macro_id == macro.macro_id and not other.stopping), None)
+                position = self.queue.position(queued) if queued is not None else 0
+            if queued is None and running is None:
+                if self.find_conflict(macro, resources) is None and not any(
+                        self.jobs_conflict(entry.job, macro, resources) for entry in self.queue):
+                    job = MacroJob(next(self.job_ids), macro, resources, requested_at)
+                    self.jobs[job.job_id] = job
+                else:
+                    queued = self.queue.push(MacroJob(next(self.job_ids), macro, resources, requested_at),
+                                             (client.addr, client.port), priority)
+                    if queued is None:
+                        self.send_message(client, 'error', 'Too many macros queued')
                         return
-                for m in macro_list:
-                    m.save(overwrite=True, only_info=True)
-                self.send_message_to_all('update-macro-list', self.get_macros(), not_to=client)
-                print("Layout has been set.")
-            except Exception as e:
-                print(f"Error setting layout: {e}")
-                self.send_message(client.sock, 'error', 'Invalid layout data')
+                    position = self.queue.position(queued)
+        if job is not None:
+            # Announced first, a short macro may already send macro-ended from its thread
+            self.send_job_event('macro-started', job)
+            self.start_macro(job)
+        elif queued is not None:
+            self.send_message(client, 'macro-queued', {'macro_id': macro.macro_id, 'job_id': queued.job.job_id,
+                                                       'position': position})
+        elif running is not None:
+            self.send_message(client, 'macro-already-running', self.job_event_data(client, running))
+
+    @staticmethod
+    def jobs_conflict(job, macro, resources):
+        return job.macro.macro_id == macro.macro_id or Macro.resources_conflict(job.resources, resources)
+
+    def find_conflict(self, macro, resources):
+        # Called with jobs_lock held, the same macro never runs twice
+        for job in self.jobs.values():
+            if self.jobs_conflict(job, macro, resources):
+                return job
+        return None
 
-    def execute_macro(self):
-        exec_ret_val = ''
+    def start_queued(self):
+        # Starts every queued macro that is free to run, one waiting in front keeps its resources reserved
+        started = []
+        with self.jobs_lock:
+            waiting = []
+            for entry in self.queue:
+                job = entry.job
+                if self.find_conflict(job.macro, job.resources) is None and not any(
+                        self.jobs_conflict(other, job.macro, job.resources) for other in waiting):
+                    self.queue.remove(entry)
+                    self.jobs[job.job_id] = job
+                    started.append(job)
+                else:
+                    waiting.append(job)
+        for job in started:
+            self.send_job_event('macro-started', job)
+            self.start_macro(job)
+
+    def handle_stop_macro(self, client, message_data):
+        # Empty data stops everything, otherwise a job id or a macro id, queued macros are dropped the same way
+        def matches(job):
+            return message_data in ('', None) or str(job.job_id) == str(message_data) \
+                or job.macro.macro_id == message_data
+
+        # A running job keeps its resources until its thread released the held keys, macro_finished() then starts
+        # the queued macros
+        with self.jobs_lock:
+            jobs = [job for job in self.jobs.values() if matches(job) and not job.stopping]
+            for job in jobs:
+                job.stopping = True
+            jobs += [entry.job for entry in self.queue.remove_where(lambda entry: matches(entry.job))]
+        if not jobs:
+            self.send_message(client, 'error', 'No macro running')
+            return
+        for job in jobs:
+            job.macro.stop()
+            self.send_job_event('macro-stopped', job)
+
+    @staticmethod
+    def job_event_data(client, job):
+        if client.job_events:
+            return {'macro_id': job.macro.macro_id, 'job_id': job.job_id}
+        return job.macro.macro_id
+
+    def send_job_event(self, msg_type, job):
+        clients = list(self.clients.values())
+        self.send_message_to_all(msg_type, job.macro.macro_id, clients=[c for c in clients if not c.job_events])
+        self.send_message_to_all(msg_type, {'macro_id': job.macro.macro_id, 'job_id': job.job_id},
+                                 clients=[c for c in clients if c.job_events])
+
+    def handle_set_layout(self, client, message_data):
+        # A list of {macro_id, position}, older clients send it as a JSON string
+        positions = {}
         try:
-            exec_ret_val = self.macro_running.execute()
+            layout = json.loads(message_data) if isinstance(message_data, str) else message_data
+            for macro in layout:
+                macro_id = macro.get('macro_id')
+                position = macro.get('position')
+                if macro_id is not None and position is not None:
+                    if not Macro.is_valid_id(macro_id) or not Macro.exists(macro_id):
+                        self.send_message(client, 'error', f'Macro {macro_id} not found')
+                        continue
+                    positions[macro_id] = position
+                else:
+                    self.send_message(client, 'error', 'Invalid layout data')
+                    return
+            Macro.save_layout(positions)
+            self.send_catalog_to_all('update-macro-list', not_to=client)
+            print("Layout has been set.")
+        except Exception as e:
+            print(f"Error setting layout: {e}")
+            self.send_message(client, 'error', 'Invalid layout data')
+
+    def handle_request_stats(self, client, message_data):
+        self.send_message(client, 'stats', self.get_stats())
+
+    def get_stats(self):
+        stats = self.metrics.snapshot()
+        stats.update(self.get_state())
+        return stats
+
+    def get_state(self):
+        with self.jobs_lock:
+            running, queued = len(self.jobs), len(self.queue)
+        cache = Macro.parse_cache.stats()
+        # Bytes waiting to be sent to each client, a growing queue shows a slow client before it's dropped
+        queues = {f'{client.addr}:{client.port}': client.queue_depth for client in list(self.clients.values())}
+        return {'clients': len(self.clients), 'client_queue_bytes': queues, 'jobs_running': running, 'jobs_queued': queued,
+                'catalog_version': self.catalog.version, 'macro_cache_hit_rate': cache['hit_rate'],
+                'macro_cache_bytes': cache['bytes'], 'macro_cache_evictions': cache['evictions'],
+                'banned_clients': len(self.forbidden_clients)}
+
+    def start_warm_up(self):
+        # The port already accepts connections, the catalog and macros are loaded meanwhile
+        threading.Thread(target=self.warm_up, daemon=True).start()
+
+    def warm_up(self):
+        try:
+            catalog = self.catalog.get_macros()
+            self.catalog.get_encoded(('macro-list', 'json', None), lambda data: self.encode_message('macro-list', data))
+            macro_ids = [info['macro_id'] for info in sorted(catalog['macro_list'], key=lambda info: info['position'])]
+            Macro.preload(macro_ids)
+            if Macro.keyboard_controller is None:
+                Macro.use_pynput()
+        except Exception as e:
+            print(f"Error warming up: {e}")
+
+    def start_stats_dump(self):
+        if self.options.stats_file:
+            self.metrics.start_dump(self.options.stats_file, self.options.stats_interval, self.get_state)
+
+    def start_watcher(self):
+        # Macros saved by the manager reach the catalog and the clients without a rescan
+        if self.options.watch_interval <= 0:
+            return
+        try:
+            targets = Macro.get_store(self.catalog.path).watch_targets()
+        except Exception as e:
+            print(f"Cannot watch macros for changes: {e}")
+            return
+        self.watcher = MacroWatcher(targets, self.on_macros_changed, self.options.watch_debounce,
+                                    self.options.watch_interval)
+        self.watcher.start()
+        print(f"Watching macros for changes ({self.watcher.mode()}).")
+
+    def on_macros_changed(self):
+        # Runs in the watcher thread, clients are only told when the catalog really changed
+        if self.catalog.refresh():
+            self.metrics.count('catalog.external_changes')
+            self.call_soon_threadsafe(self.send_catalog_to_all, 'update-macro-list')
+
+    def handle_batch(self, client, message_data):
+        # Runs the operations in order and answers with one batch-result holding the replies to each of them
+        if client.batch_replies is not None:
+            self.send_message(client, 'error', 'Batches can not be nested')
+            return
+        if not isinstance(message_data, list) or len(message_data) > MAX_BATCH_OPERATIONS:
+            self.send_message(client, 'error', 'Invalid batch data')
+            return
+        results = []
+        try:
+            for operation in message_data:
+                client.batch_replies = []
+                try:
+                    if not isinstance(operation, dict):
+                        raise ValueError('Operation is not a message')
+                    self.handle_message(operation, client)
+                except Exception as e:
+                    print(f"Error in batch operation: {e}")
+                    client.batch_replies.append({'type': 'error', 'data': f'Invalid operation: {e}'})
+                results.append(client.batch_replies)
+        finally:
+            client.batch_replies = None
+        self.send_message(client, 'batch-result', results)
+
+    def negotiate(self, client, options):
+        # Optional hello from the client, the reply is sent with the old framing and both sides switch after it
+        if not isinstance(options, dict):
+            return
+        framing = options.get('framing', 'json')
+        if framing not in ('json', 'binary'):
+            framing = 'json'
+        # Compression is only possible with binary frames, the client lists the methods it supports
+        compression = None
+        requested = options.get('compression') or []
+        if isinstance(requested, str):
+            requested = [requested]
+        if framing == 'binary':
+            compression = next((method for method in requested if method in codec.COMPRESSION_METHODS), None)
+        self.send_message(client, 'hello', {'framing': framing, 'max_frame_size': self.options.max_frame_size,
+                                            'compression': compression,
+                                            'compression_threshold': self.options.compression_threshold,
+                                            'heartbeat_interval': self.options.heartbeat_interval,
+                                            'heartbeat_timeout': self.options.heartbeat_timeout,
+                                            'jobs': bool(options.get('jobs'))})
+        client.framing = framing
+        client.compression = compression
+        client.job_events = bool(options.get('jobs'))
+
+    def mark_started(self, job):
+        job.started_at = time.perf_counter()
+        self.metrics.observe('macro.queue_wait', job.started_at - job.requested_at)
+
+    def start_macro(self, job):
+        self.mark_started(job)
+        t = threading.Thread(target=self.execute_macro, args=(job,), daemon=False)
+        t.start()
+
+    def execute_macro(self, job):
+        self.macro_finished(job, self.run_macro(job.macro, self.progress_reporter(job)))
+
+    @staticmethod
+    def run_macro(macro, progress=None):
+        try:
+            return macro.execute(progress)
         except Exception as e:
             print(f"Error executing macro: {e}")
-            self.send_message_to_all('macro-ended', 'Unexpected error')
+            return 'exception'
+
+    def progress_reporter(self, job):
+        # Runs in the macro thread, the latest progress is handed to the loop at most progress_rate times a second
+        if self.options.progress_rate <= 0:
+            return None
+        interval = 1 / self.options.progress_rate
+
+        def report(index, total, elapsed):
+            job.progress = (index, total, elapsed)
+            now = time.monotonic()
+            if job.progress_pending or now < job.next_progress:
+                return
+            job.next_progress = now + interval
+            job.progress_pending = True
+            self.call_soon_threadsafe(self.send_progress, job)
+
+        return report
+
+    def send_progress(self, job):
+        job.progress_pending = False
+        if job.job_id not in self.jobs or job.stopping:
+            return  # Already ended or stopped
+        index, total, elapsed = job.progress
+        data = {'macro_id': job.macro.macro_id, 'job_id': job.job_id, 'index': index, 'total': total,
+                'elapsed': round(elapsed, 3)}
+        clients = []
+        for client in list(self.clients.values()):
+            if not client.sock:
+                continue
+            if client.progress_bucket is None:
+                client.progress_bucket = TokenBucket(self.options.progress_rate, self.options.progress_rate)
+            if client.progress_bucket.take():
+                clients.append(client)
+        self.send_message_to_all('macro-progress', data, clients=clients)
 
-        if exec_ret_val == 'success':
-            self.send_message_to_all('macro-ended', self.macro_running.macro_id)
+    def macro_finished(self, job, exec_ret_val):
+        with self.jobs_lock:
+            self.jobs.pop(job.job_id, None)
+        if job.stopping:
+            pass  # Client already notified with macro-stopped, even if the macro finished meanwhile
+        elif exec_ret_val in ('success', 'exception'):
+            # A macro that failed has ended too, the error was printed by run_macro()
+            self.send_job_event('macro-ended', job)
         elif exec_ret_val == 'stopped':
             pass  # Client already notified
         else:
-            self.send_message_to_all('macro-ended', self.macro_running.macro_id)
+            self.send_job_event('macro-ended', job)
             print(f'Unexpected return value from macro.execute(): {exec_ret_val}')
-        self.macro_running = None
+        self.metrics.count(f'macros.{exec_ret_val}')
+        if job.macro.first_event_time is not None:
+            # Measured from the start, the time spent queued behind other macros is in macro.queue_wait
+            latency = job.macro.first_event_time - job.started_at
+            self.metrics.observe('macro.first_input', latency)
+            if job.macro.timing:
+                self.metrics.observe('macro.timing_drift', job.macro.max_drift)
+            print(f'Macro {job.macro.macro_id} sent its first input {latency * 1000:.1f} ms after it started '
+                  f'({(job.macro.first_event_time - job.requested_at) * 1000:.1f} ms after the request), '
+                  f'macro cache hit rate {Macro.parse_cache.hit_rate():.0%}.')
+        self.start_queued()
+
+    def remove_queued(self, client):
+        with self.jobs_lock:
+            self.queue.remove_where(lambda entry: entry.client == (client.addr, client.port))
+
+    def stop_all_macros(self):
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+            self.queue.remove_where(lambda entry: True)
+        for job in jobs:
+            job.macro.stop()
 
     def get_macro(self, macro_id):
-        return Macro.load(f'macros/{macro_id}.json')
+        # Always from the macros directory, a client can't point the server at other files
+        if not Macro.is_valid_id(macro_id):
+            return None
+        return Macro.load_id(macro_id)
 
     def get_macros(self):
-        return Macro.get_all_macros_info()
+        return self.catalog.get_macros()
+
+    def send_catalog(self, client, msg_type):
+        if client.batch_replies is not None:
+            self.send_message(client, msg_type, self.get_macros())
+            return
+        def encode(data):
+            start = time.perf_counter()
+            encoded = self.encode_for(client, msg_type, data)
+            self.metrics.observe('catalog.encode', time.perf_counter() - start)
+            return encoded
+
+        self.write(client, self.catalog.get_encoded((msg_type, client.framing, client.compression), encode))
+        if client.catalog_version is not None:
+            client.catalog_version = self.catalog.version
+
+    def send_catalog_update(self, client, msg_type, message_data):
+        # Clients that send the last version and epoch they know get only the changes since then
+        since = message_data.get('version') if isinstance(message_data, dict) else None
+        if isinstance(since, int):
+            client.catalog_version = since
+            delta = self.catalog.get_delta(since, message_data.get('epoch'))
+            if delta is not None:
+                self.send_message(client, 'macro-list-delta', delta)
+                client.catalog_version = delta['version']
+                return
+        self.send_catalog(client, msg_type)
+
+    def send_catalog_to_all(self, msg_type, not_to=None):
+        deltas = {}
+        for client in list(self.clients.values()):
+            if client is not_to or not client.sock:
+                continue
+            key = (client.catalog_version, client.framing, client.compression)
+            if client.catalog_version is not None and key not in deltas:
+                delta = self.catalog.get_delta(client.catalog_version, self.catalog.epoch)
+                deltas[key] = (self.encode_for(client, 'macro-list-delta', delta), delta['version']) if delta else None
+            if client.batch_replies is not None:
+                self.send_catalog_update(client, msg_type, {'version': client.catalog_version,
+                                                            'epoch': self.catalog.epoch})
+            elif client.catalog_version is not None and deltas[key] is not None:
+                data, client.catalog_version = deltas[key]
+                self.write(client, data)
+            else:
+                self.send_catalog(client, msg_type)
 
     def end(self):
-        for _, client in self.clients.items():
+        for client in list(self.clients.values()):
             self.disconnect_client(client)
 
-        if self.macro_running:
-            self.macro_running.stop()
+        self.stop_all_macros()
+        self.metrics.stop_dump()
+        if self.watcher is not None:
+            self.watcher.stop()
         try:
             self.accept_sock.close()
         except Exception as e:
             print(f"Error closing server accept socket: {e}")
+        if self.waker is not None:
+            self.waker.close()
+            self.wakeup_sock.close()
+        if self.approvals is not None:
+            self.approvals.stop()
 
         self.sel.close()
 
         print("Server closed.")
 
 
+class AsyncClient(SocketClient):
+    @property
+    def queue_depth(self):
+        if self.sock is None:
+            return 0
+        return self.sock.get_write_buffer_size()
+
+
+class ClientProtocol(asyncio.BufferedProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.client = None
+
+    def connection_made(self, transport):
+        self.client = self.server.connection_made(transport)
+
+    def get_buffer(self, sizehint):
+        # Data is received straight into the client's frame buffer
+        if self.client is None:
+            return bytearray(4096)
+        return self.client.buffer.get_buffer(max(sizehint, 4096))
+
+    def buffer_updated(self, nbytes):
+        if self.client is not None:
+            self.client.buffer.written(nbytes)
+            self.server.data_received(self.client)
+
+    def connection_lost(self, exc):
+        if self.client is not None:
+            self.server.connection_lost(self.client)
+        self.client = None
+
+
+class AsyncServer(Server):
+    def __init__(self, options: ServerOptions = None):
+        super().__init__(options)
+        self.loop = None
+        self.server = None
+        self.executor = None
+        self.heartbeat_timer = None
+
+    def run(self, server_addr, port, max_attempts, auth_mode):
+        self.auth_mode = auth_mode
+        try:
+            asyncio.run(self.serve(server_addr, port, max_attempts))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, server_addr, port, max_attempts):
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(thread_name_prefix='macro')
+        if self.auth_mode:
+            self.approvals = ApprovalQueue(lambda pending, decision: self.loop.call_soon_threadsafe(
+                self.on_approval, pending, decision), self.options.auth_timeout)
+            self.approvals.start()
+        for i in range(max_attempts):
+            try_port = port + i
+            try:
+                self.server = await self.loop.create_server(lambda: ClientProtocol(self), server_addr, try_port)
+                break
+            except OSError:
+                print(f'Cannot listen on {server_addr}:{try_port}.')
+        else:
+            print(f'Could not bind to any port after {max_attempts} attempts. Exiting.')
+            sys.exit(1)
+
+        print(f'Server listening on {server_addr}:{try_port}.')
+        self.start_warm_up()
+        self.start_stats_dump()
+        self.start_watcher()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error: {e}")
+        finally:
+            if self.heartbeat_timer is not None:
+                self.heartbeat_timer.cancel()
+            self.end()
+
+    def schedule_heartbeat_check(self):
+        # One timer armed at the nearest deadline, it's moved forward only when it fires
+        if self.heartbeat_timer is None:
+            deadline = self.heartbeats.next_deadline()
+            if deadline is not None:
+                delay = max(0, deadline - time.monotonic())
+                self.heartbeat_timer = self.loop.call_at(self.loop.time() + delay, self.check_heartbeats)
+
+    def check_heartbeats(self):
+        self.heartbeat_timer = None
+        self.expire_heartbeats()
+        self.schedule_heartbeat_check()
+
+    def answer_heartbeat(self, client, cheap=False):
+        super().answer_heartbeat(client, cheap)
+        self.schedule_heartbeat_check()
+
+    def connection_made(self, transport):
+        addr = transport.get_extra_info('peername')[:2]
+        print(f'Client connected: {addr[0]}:{addr[1]}')
+        self.metrics.count('connections.opened')
+        if addr[0] in self.forbidden_clients:
+            print(f'Forbidden client {addr} tried to connect, disconnecting them.')
+            transport.write(self.encode_message('hello', 'reject'))
+            transport.close()
+            return None
+
+        client = AsyncClient(transport, addr[0], addr[1], self.options.max_frame_size)
+        if self.auth_mode:
+            transport.pause_reading()
+            self.approvals.submit(client, addr)
+            self.loop.call_later(self.approvals.timeout, self.expire_approvals)
+        else:
+            self.accept_client(client)
+        return client
+
+    def expire_approvals(self):
+        for pending in self.approvals.pop_expired():
+            self.finish_approval(pending, 'timeout')
+
+    def finish_approval(self, pending, decision):
+        client = pending.connection
+        if client.sock is None:
+            return
+        if decision == 'accept':
+            client.sock.resume_reading()
+            self.accept_client(client)
+            return
+        if decision == 'ban':
+            self.forbidden_clients.ban(client.addr)
+        elif decision == 'timeout':
+            print(f'Connection from {client.addr}:{client.port} was not approved in time, rejecting it.')
+        self.write(client, self.encode_message('hello', 'reject'))
+        self.disconnect_client(client)
+
+    def accept_client(self, client):
+        self.clients[(client.addr, client.port)] = client
+        client.authorized = True
+        client.last_heartbeat = time.time()
+        self.heartbeats.touch((client.addr, client.port))
+        self.schedule_heartbeat_check()
+        self.send_message(client, 'hello', 'accept')
+
+    def data_received(self, client):
+        if client.addr in self.forbidden_clients:
+            print(f'Attempt to send message from forbidden client {(client.addr, client.port)}.')
+            self.disconnect_client(client)
+            return
+
+        if not client.authorized:
+            print(f"Unauthorized client {(client.addr, client.port)}.")
+            return
+
+        try:
+            self.process_buffer(client)
+        except Exception as e:
+            print(f"Error retrieving message: {e}")
+            self.disconnect_client(client)
+
+    def connection_lost(self, client):
+        if self.approvals is not None:
+            pending = self.approvals.waiting.get((client.addr, client.port))
+            if pending is not None:
+                self.approvals.resolve(pending)
+        if (client.addr, client.port) in self.clients:
+            print(f"Client {client.addr}, {client.port} disconnected.")
+        self.remove_client(client)
+
+    def remove_client(self, client):
+        client.sock = None
+        if self.clients.pop((client.addr, client.port), None) is not None:
+            self.metrics.count('connections.closed')
+        self.heartbeats.remove((client.addr, client.port))
+        self.remove_queued(client)
+
+    def write(self, client, data, droppable=False):
+        transport = client.sock
+        if transport is None or transport.is_closing():
+            return
+        # The transport sends what it can right away and buffers the rest until the socket is writable
+        queued = transport.get_write_buffer_size()
+        if queued + len(data) > self.options.max_queue_size:
+            if droppable and self.options.slow_client_policy == 'drop':
+                return
+            print(f'Client {client.addr}:{client.port} is too slow ({queued} bytes queued), disconnecting.')
+            self.metrics.count('connections.too_slow')
+            transport.abort()
+            self.remove_client(client)
+            return
+        transport.write(data)
+
+    def disconnect_client(self, client):
+        if client.sock is not None:
+            client.sock.close()
+        self.remove_client(client)
+
+    def call_soon_threadsafe(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # Loop is closed
+
+    def start_macro(self, job):
+        self.mark_started(job)
+        future = self.loop.run_in_executor(self.executor, self.run_macro, job.macro, self.progress_reporter(job))
+        future.add_done_callback(lambda f: self.macro_finished(job, f.result()))
+
+    def end(self):
+        for client in list(self.clients.values()):
+            self.disconnect_client(client)
+
+        self.stop_all_macros()
+        self.metrics.stop_dump()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+        if self.approvals is not None:
+            self.approvals.stop()
+
+        print("Server closed.")
+
+
 def check_firewall_rule(port, count=1):
     command = f"netsh advfirewall firewall show rule name=\"MacroServer\""
 
@@ -337,6 +1213,23 @@ def run_as_admin():
         ctypes.windll.shell32.ShellExecuteW(None, "runas", sys.executable, " ".join(sys.argv), None, 1)
 
 
+def parse_rate_limits(ctx, param, value):
+    # CLASS=RATE[/BURST] overrides the default limit of the class, rate 0 disables it
+    rate_limits = dict(RATE_LIMITS)
+    for limit in value:
+        try:
+            limit_class, rate = limit.split('=')
+            rate, _, burst = rate.partition('/')
+            rate = float(rate)
+            burst = float(burst) if burst else max(rate, 1.0)
+        except ValueError:
+            raise click.BadParameter(f"'{limit}' is not in the CLASS=RATE[/BURST] format")
+        if limit_class not in RATE_LIMITS:
+            raise click.BadParameter(f"Unknown class '{limit_class}', use one of {', '.join(RATE_LIMITS)}")
+        rate_limits[limit_class] = (rate, burst)
+    return rate_limits
+
+
 @click.command()
 @click.option('--server', '-s', default="", help="Server address to bind to, default is all interfaces.")
 @click.option('--port', '-p', type=int, default=5908, help="Port to bind to.")
@@ -346,7 +1239,54 @@ def run_as_admin():
               help="Check and configure firewall rule for the port or port range, see --max_attemts")
 @click.option('--auth', '-a', is_flag=True,
               help="Require manual authorization of clients, by default all clients are automatically accepted.")
-def main(server, port, max_attempts, manage_firewall, auth):
+@click.option('--auth-timeout', type=float, default=30,
+              help="Seconds a connection waits for manual authorization before it's rejected.")
+@click.option('--max-frame-size', type=int, default=1024,
+              help="Maximum size of a single message from a client in KiB.")
+@click.option('--compression-threshold', type=int, default=1024,
+              help="Messages smaller than this number of bytes are never compressed, for clients that enable compression.")
+@click.option('--heartbeat-timeout', type=float, default=15,
+              help="Seconds without a heartbeat after which a client is disconnected.")
+@click.option('--heartbeat-interval', type=float, default=5,
+              help="Heartbeat interval suggested to clients that send hello.")
+@click.option('--loop', type=click.Choice(['asyncio', 'selectors']), default='asyncio',
+              help="Server event loop implementation, 'selectors' is the original loop.")
+@click.option('--max-queue-size', type=int, default=1024,
+              help="Maximum size of unsent data per client in KiB.")
+@click.option('--slow-client-policy', type=click.Choice(['drop', 'disconnect']), default='drop',
+              help="What to do with a client whose outbound queue is full - drop its heartbeat and progress messages, or disconnect it.")
+@click.option('--max-queued-per-client', type=int, default=8,
+              help="Maximum number of macros a single client can have waiting in the execution queue.")
+@click.option('--coalesce-window', type=int, default=300,
+              help="Milliseconds in which repeated requests to execute the same macro are treated as one.")
+@click.option('--macro-cache-size', type=int, default=64,
+              help="MiB of parsed macros kept in memory for faster start, 0 disables the cache.")
+@click.option('--stats-file', type=click.Path(dir_okay=False), default=None,
+              help="File the server metrics are periodically written to as JSON, disabled by default.")
+@click.option('--stats-interval', type=float, default=60,
+              help="Seconds between writes of the --stats-file.")
+@click.option('--progress-rate', type=float, default=5,
+              help="Maximum macro-progress messages per second sent to a client, 0 disables progress messages.")
+@click.option('--input-backend', type=click.Choice(['pynput', 'null']), default='pynput',
+              help="Where macro input goes, 'null' runs macros without sending any input (for testing).")
+@click.option('--rate-limit', 'rate_limits', multiple=True, callback=parse_rate_limits,
+              help="Messages per second a client can send in a class, as CLASS=RATE[/BURST], can be repeated. Classes are catalog, execute, layout and stats.")
+@click.option('--max-buffered', type=int, default=2048,
+              help="Maximum size of received data waiting to be processed per client in KiB.")
+@click.option('--flood-rate', type=float, default=100,
+              help="Messages per second of any type after which a client is banned, 0 disables it.")
+@click.option('--ban-duration', type=float, default=300,
+              help="Seconds a flooding client stays banned.")
+@click.option('--storage', type=click.Choice(['auto', 'json', 'sqlite']), default='auto',
+              help="Where macros are stored, 'auto' uses macros.db if it exists (see migrate_storage.py) and the JSON files otherwise.")
+@click.option('--watch-interval', type=float, default=1.0,
+              help="Seconds between checks for macros changed by other programs where inotify isn't available, 0 disables watching.")
+@click.option('--write-behind', type=int, default=500,
+              help="Milliseconds layout changes wait to be written together in the background, 0 writes them right away.")
+def main(server, port, max_attempts, manage_firewall, auth, auth_timeout, max_frame_size, compression_threshold,
+         heartbeat_timeout, heartbeat_interval, loop, max_queue_size, slow_client_policy, max_queued_per_client,
+         coalesce_window, macro_cache_size, stats_file, stats_interval, progress_rate, input_backend, rate_limits,
+         max_buffered, flood_rate, ban_duration, storage, watch_interval, write_behind):
     if manage_firewall:
         if not is_admin():
             print(
@@ -367,8 +1307,27 @@ def main(server, port, max_attempts, manage_firewall, auth):
         if is_admin():
             print(f"Running as admin is not recommended, are you sure?")
             input("Press Enter to continue...")
-    srv = Server()
+    options = ServerOptions(max_queue_size=max_queue_size * 1024, slow_client_policy=slow_client_policy,
+                            auth_timeout=auth_timeout, max_frame_size=max_frame_size * 1024,
+                            compression_threshold=compression_threshold, heartbeat_timeout=heartbeat_timeout,
+                            heartbeat_interval=heartbeat_interval, max_queued_per_client=max_queued_per_client,
+                            coalesce_window=coalesce_window / 1000, macro_cache_size=macro_cache_size * 2 ** 20,
+                            stats_file=stats_file, stats_interval=stats_interval, progress_rate=progress_rate,
+                            rate_limits=rate_limits, max_buffered=max_buffered * 1024, flood_rate=flood_rate,
+                            ban_duration=ban_duration, watch_interval=watch_interval)
+    if storage == 'json':
+        Macro.use_store(JsonMacroStore("macros"))
+    elif storage == 'sqlite':
+        Macro.use_store(SqliteMacroStore("macros"))
+    if write_behind > 0:
+        Macro.use_store(WriteBehindStore(Macro.get_store("macros"), write_behind / 1000))
+    if input_backend == 'null':
+        Macro.keyboard_controller = NullController
+        Macro.mouse_controller = NullController
+    srv = AsyncServer(options) if loop == 'asyncio' else Server(options)
     srv.run(server, port, max_attempts, auth)
+    # Writes what the write-behind store still holds
+    Macro.get_store("macros").close()
 
 
 if __name__ == "__main__":
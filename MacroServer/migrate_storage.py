@@ -0,0 +1,44 @@
+import os
+import sys
+
+import click
+
+from macro import JsonMacroStore, MacroStore, SqliteMacroStore, command_codec
+
+
+@click.command()
+@click.option('--path', default="macros", help="Directory with the JSON macro files.")
+@click.option('--force', is_flag=True,
+              help="Copy the macros even if the database already exists, macros with the same id are overwritten.")
+def main(path, force):
+    # Copies every macro into macros.db in one transaction, the JSON files are left where they are
+    database = MacroStore.database_path(path)
+    existed = os.path.exists(database)
+    if existed and not force:
+        print(f"{database} already exists, use --force to copy the macros again.")
+        sys.exit(1)
+    source = JsonMacroStore(path)
+    macros = []
+    for macro_id, info in source.list_info():
+        try:
+            macros.append((macro_id, info, command_codec.to_dicts(source.read_commands(macro_id))))
+        except Exception as e:
+            print(f"Could not read commands of {macro_id}: {e}")
+    target = SqliteMacroStore(path)
+    try:
+        target.write_many(macros)
+    except Exception as e:
+        print(f"Migration failed, nothing was written: {e}")
+        target.close()
+        if not existed:
+            # An empty database would be picked up instead of the JSON files
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(database + suffix):
+                    os.remove(database + suffix)
+        sys.exit(1)
+    target.close()
+    print(f"Migrated {len(macros)} macros to {database}, the server and the manager use it from now on.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from . import codec
+from .approval_queue import ApprovalQueue, PendingConnection
+from .ban_list import BanList
+from .execution_queue import ExecutionQueue, QueuedMacro
+from .frame_buffer import FrameBuffer, FrameTooLarge
+from .heartbeat_scheduler import HeartbeatScheduler
+from .metrics import Histogram, Metrics
+from .token_bucket import TokenBucket
+
+__all__ = ["codec", "ApprovalQueue", "PendingConnection", "BanList", "ExecutionQueue", "QueuedMacro", "FrameBuffer",
+           "FrameTooLarge", "HeartbeatScheduler", "Histogram", "Metrics", "TokenBucket"]
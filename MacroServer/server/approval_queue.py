@@ -0,0 +1,133 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class PendingConnection:
+    def __init__(self, connection, addr, deadline):
+        self.connection = connection
+        self.addr = addr
+        self.deadline = deadline
+        self.done = False
+        self.answered = False  # An answer was typed, the decision is on its way to the server loop
+
+
+class ApprovalQueue:
+    # Answers typed in the console are read all the time and go to the oldest connection that wasn't answered yet,
+    # its prompt is printed again whenever that connection changes, e.g. when the one asked about timed out
+    def __init__(self, on_decision, timeout=30.0):
+        # on_decision(pending, decision) is called from the console thread, decision is 'accept', 'reject' or 'ban'
+        self.on_decision = on_decision
+        self.timeout = timeout
+        self.waiting: OrderedDict[tuple, PendingConnection] = OrderedDict()
+        self.lock = threading.Condition()
+        self.prompted = None  # The connection the last prompt asked about
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.console_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify()
+
+    def submit(self, connection, addr):
+        pending = PendingConnection(connection, addr, time.monotonic() + self.timeout)
+        with self.lock:
+            self.waiting[addr] = pending
+            print(f"Connection from {addr[0]}:{addr[1]} is waiting for approval ({len(self.waiting)} pending).")
+            self.prompt()
+            self.lock.notify()
+        return pending
+
+    def resolve(self, pending):
+        # Returns False if the connection was already resolved (e.g. timed out while the prompt was open)
+        with self.lock:
+            if pending.done:
+                return False
+            pending.done = True
+            self.waiting.pop(pending.addr, None)
+            if pending is self.prompted and not pending.answered:
+                addr = pending.addr
+                print(f"\nConnection from {addr[0]}:{addr[1]} is no longer waiting for approval.")
+            self.prompt()
+            return True
+
+    def head(self):
+        # Called with the lock held, the connection the next answer is for
+        for pending in self.waiting.values():
+            if not pending.answered:
+                return pending
+        return None
+
+    def prompt(self):
+        # Called with the lock held
+        pending = self.head()
+        if pending is not None and pending is not self.prompted:
+            self.prompted = pending
+            addr = pending.addr
+            print(f"Approve connection from {addr[0]}:{addr[1]}? Yes / No / Ban (y/n/b): ", end="", flush=True)
+
+    def next_deadline(self):
+        with self.lock:
+            for pending in self.waiting.values():
+                return pending.deadline
+        return None
+
+    def pop_expired(self, now=None):
+        # All connections share the same timeout, so the oldest one always expires first
+        now = time.monotonic() if now is None else now
+        expired = []
+        while True:
+            with self.lock:
+                pending = next(iter(self.waiting.values()), None)
+            if pending is None or pending.deadline > now:
+                break
+            self.resolve(pending)
+            expired.append(pending)
+        return expired
+
+    def take_head(self):
+        # Marks the connection an answer is for, None if nobody is waiting
+        with self.lock:
+            pending = self.head()
+            if pending is not None:
+                pending.answered = True
+            return pending
+
+    def console_loop(self):
+        while not self.stopped:
+            try:
+                approve = input()
+            except EOFError:
+                self.reject_all()  # No console to ask
+                return
+            pending = self.take_head()
+            if pending is None:
+                print("No connection is waiting for approval.")
+                continue
+            if approve.lower() == 'y' or approve.lower() == 'yes':
+                self.on_decision(pending, 'accept')
+            elif approve.lower() == 'b' or approve.lower() == 'ban':
+                self.on_decision(pending, 'ban')
+            else:
+                self.on_decision(pending, 'reject')
+            with self.lock:
+                self.prompt()
+
+    def reject_all(self):
+        # Without a console every connection is rejected as it comes
+        while True:
+            with self.lock:
+                while not self.stopped and self.head() is None:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                pending = self.head()
+                pending.answered = True
+            self.on_decision(pending, 'reject')
@@ -0,0 +1,26 @@
+import time
+
+
+class BanList:
+    def __init__(self):
+        # address -> monotonic time the ban ends, None bans the address until the server stops
+        self.expiry: dict[str, float] = {}
+
+    def ban(self, addr, duration=None):
+        self.expiry[addr] = None if duration is None else time.monotonic() + duration
+
+    def unban(self, addr):
+        self.expiry.pop(addr, None)
+
+    def __contains__(self, addr):
+        if addr not in self.expiry:
+            return False
+        expiry = self.expiry[addr]
+        if expiry is not None and expiry <= time.monotonic():
+            del self.expiry[addr]
+            return False
+        return True
+
+    def __len__(self):
+        now = time.monotonic()
+        return sum(1 for expiry in list(self.expiry.values()) if expiry is None or expiry > now)
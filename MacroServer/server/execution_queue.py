@@ -0,0 +1,81 @@
+import bisect
+import itertools
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+@dataclass(order=True)
+class QueuedMacro:
+    sort_key: tuple
+    job: object = field(compare=False)
+    client: object = field(compare=False)
+    priority: int = field(compare=False, default=0)
+
+
+class ExecutionQueue:
+    def __init__(self, max_per_client=8, coalesce_window=0.3):
+        self.max_per_client = max_per_client
+        self.coalesce_window = coalesce_window
+        # Kept sorted, higher priority first and FIFO within a priority
+        self.entries: list[QueuedMacro] = []
+        self.counter = itertools.count()
+        self.per_client = {}
+        # macro_id -> time of the last accepted request, oldest first
+        self.recent: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def coalesce(self, macro_id, now=None):
+        # True if the same macro was requested within the window, otherwise the request is remembered
+        now = time.monotonic() if now is None else now
+        while self.recent:
+            _, requested = next(iter(self.recent.items()))
+            if now - requested < self.coalesce_window:
+                break
+            self.recent.popitem(last=False)
+        if macro_id in self.recent:
+            return True
+        self.recent[macro_id] = now
+        return False
+
+    def push(self, job, client, priority=0):
+        # Returns None if the client already has too many macros waiting
+        if self.per_client.get(client, 0) >= self.max_per_client:
+            return None
+        entry = QueuedMacro((-priority, next(self.counter)), job, client, priority)
+        bisect.insort(self.entries, entry)
+        self.per_client[client] = self.per_client.get(client, 0) + 1
+        return entry
+
+    def position(self, entry):
+        # 1-based, 0 if the entry isn't queued anymore
+        index = bisect.bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] is entry:
+            return index + 1
+        return 0
+
+    def find(self, macro_id):
+        for entry in self.entries:
+            if entry.job.macro.macro_id == macro_id:
+                return entry
+        return None
+
+    def remove(self, entry):
+        index = bisect.bisect_left(self.entries, entry)
+        if index < len(self.entries) and self.entries[index] is entry:
+            del self.entries[index]
+            self.per_client[entry.client] -= 1
+            if not self.per_client[entry.client]:
+                del self.per_client[entry.client]
+
+    def remove_where(self, predicate):
+        removed = [entry for entry in self.entries if predicate(entry)]
+        for entry in removed:
+            self.remove(entry)
+        return removed
@@ -0,0 +1,72 @@
+from .codec import FRAME_HEADER
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+class FrameBuffer:
+    def __init__(self, max_frame_size=1024 * 1024, initial_size=4096):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(initial_size)
+        self.start = 0
+        self.end = 0
+        self.scanned = 0  # Bytes after start already searched for a newline
+
+    def __len__(self):
+        return self.end - self.start
+
+    def get_buffer(self, size_hint=4096):
+        # Returns free space at the end of the buffer, the caller writes into it and calls written()
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+        if len(self.buffer) - self.end < size_hint:
+            if self.start:
+                # Move the unprocessed data to the front
+                self.buffer[:self.end - self.start] = self.buffer[self.start:self.end]
+                self.end -= self.start
+                self.start = 0
+            if len(self.buffer) - self.end < size_hint:
+                self.buffer.extend(bytes(max(size_hint, len(self.buffer))))
+        return memoryview(self.buffer)[self.end:]
+
+    def written(self, size):
+        self.end += size
+
+    def recv_into(self, sock, size_hint=4096):
+        with self.get_buffer(size_hint) as view:
+            received = sock.recv_into(view)
+        self.written(received)
+        return received
+
+    def feed(self, data):
+        with self.get_buffer(len(data)) as view:
+            view[:len(data)] = data
+        self.written(len(data))
+
+    def next_line(self):
+        index = self.buffer.find(b'\n', self.start + self.scanned, self.end)
+        if index == -1:
+            self.scanned = self.end - self.start
+            if self.scanned > self.max_frame_size:
+                raise FrameTooLarge(f"Message longer than {self.max_frame_size} bytes")
+            return None
+        line = bytes(self.buffer[self.start:index])
+        self.start = index + 1
+        self.scanned = 0
+        return line
+
+    def next_frame(self):
+        # Returns (flags, payload) of the next complete frame
+        if self.end - self.start < FRAME_HEADER.size:
+            return None
+        length, flags = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"Frame of {length} bytes is larger than {self.max_frame_size} bytes")
+        frame_end = self.start + FRAME_HEADER.size + length
+        if frame_end > self.end:
+            return None
+        payload = bytes(self.buffer[self.start + FRAME_HEADER.size:frame_end])
+        self.start = frame_end
+        self.scanned = 0
+        return flags, payload
@@ -0,0 +1,38 @@
+import time
+
+from collections import OrderedDict
+
+
+class HeartbeatScheduler:
+    def __init__(self, timeout=15.0):
+        self.timeout = timeout
+        # Every client gets the same timeout, so moving a client to the end on each heartbeat keeps the
+        # dict sorted by deadline - rescheduling is O(1) and the first entry is always the next to expire
+        self.deadlines: OrderedDict[object, float] = OrderedDict()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def touch(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        self.deadlines[key] = now + self.timeout
+        self.deadlines.move_to_end(key)
+
+    def remove(self, key):
+        self.deadlines.pop(key, None)
+
+    def next_deadline(self):
+        for deadline in self.deadlines.values():
+            return deadline
+        return None
+
+    def pop_expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.deadlines:
+            key, deadline = next(iter(self.deadlines.items()))
+            if deadline > now:
+                break
+            self.deadlines.popitem(last=False)
+            expired.append(key)
+        return expired
@@ -0,0 +1,92 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds, the last bucket takes everything above
+HISTOGRAM_BOUNDS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                    2.5, 5.0, 10.0]
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket the percentile falls in, never more than the maximum
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(HISTOGRAM_BOUNDS[i], self.max) if i < len(HISTOGRAM_BOUNDS) else self.max
+        return 0.0
+
+    def snapshot(self):
+        return {"count": self.count,
+                "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p50_ms": self.percentile(0.5) * 1000,
+                "p99_ms": self.percentile(0.99) * 1000,
+                "max_ms": self.max * 1000}
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        # Updates come from the loop and the macro threads, the lock is almost never contended
+        self.lock = threading.Lock()
+        self.dump_thread = None
+        self.dump_stop = threading.Event()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {"uptime": time.time() - self.started,
+                    "counters": dict(self.counters),
+                    "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()}}
+
+    def start_dump(self, path, interval, extra=None):
+        # Writes the snapshot to the file every interval seconds, extra() can add values known only to the caller
+        def dump_loop():
+            while not self.dump_stop.wait(interval):
+                self.dump(path, extra)
+
+        self.dump_thread = threading.Thread(target=dump_loop, daemon=True)
+        self.dump_thread.start()
+
+    def stop_dump(self):
+        self.dump_stop.set()
+
+    def dump(self, path, extra=None):
+        stats = self.snapshot()
+        if extra is not None:
+            stats.update(extra())
+        try:
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(stats, file, indent=2)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"Error writing stats: {e}")
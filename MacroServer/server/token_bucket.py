@@ -0,0 +1,18 @@
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens added per second
+        self.burst = burst  # Most tokens the bucket holds
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, tokens=1, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True